@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# the catalog pages and the subjects/contents api are async views (courses/views.py,
+# courses/api/views.py), they only run concurrently behind an ASGI server, i.e.
+# uvicorn config.asgi:application
 application = get_asgi_application()
@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it also sees the queries of the other middlewares (sessions, auth)
+    'courses.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # if you want to cache your entire site so add line bellow to your middleare
@@ -213,10 +215,17 @@ LOGIN_REDIRECT_URL = reverse_lazy('students:student_course_list')
 
 
 
+# courses.backends.memcached.PooledMemcachedCache:
+    # pooled connections shared by the threads, keys spread over all the LOCATION nodes
+    # with a consistent hash ring and pipelined get_many/set_many (see the module)
+    # add more nodes to LOCATION, i.e. ['10.0.0.1:11211', '10.0.0.2:11211']
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
-        'LOCATION': '127.0.0.1:11211',
+        'BACKEND': 'courses.backends.memcached.PooledMemcachedCache',
+        'LOCATION': ['127.0.0.1:11211'],
+        'OPTIONS': {
+            'max_pool_size': 16,
+        },
     }
 }
 
@@ -226,6 +235,35 @@ CACHE_MIDDLEWARE_SECONDS = 60 * 15  # 15 minutes which is the timeout
 CACHE_MIDDLEWARE_KEY_PREFIX = 'config'
 # my site right now cache all my site which has a get request
 
+# catalog entries (course_list) are invalidated by versioned keys, see courses/cache.py
+# so they can live much longer than the pages
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# query budgets (see courses/querybudget.py): the maximum number of queries of every url name
+# with an empty cache, including the session and user queries of a logged in user
+QUERY_BUDGETS = {
+    'course_list': 3,
+    'courses:course_list_subject': 3,
+    'courses:course_detail': 3,
+    'courses:manage_course_list': 3,
+    'courses:course_module_update': 5,
+    'courses:module_content_list': 8,
+    'students:student_course_list': 4,
+    'students:student_course_detail': 8,
+    'course-list': 3,
+    'course-detail': 3,
+    'course-contents': 6,
+    'subject_list': 2,
+    'subject_detail': 2,
+    'courses:search': 3,
+    'search': 3,
+}
+# the share of the requests which are checked, a view over its budget logs a warning
+# on the 'courses.queries' logger (or raises QueryBudgetExceeded with QUERY_BUDGET_STRICT)
+QUERY_BUDGET_SAMPLE_RATE = 0.01
+QUERY_BUDGET_STRICT = False
+
 
 # django restframework
 REST_FRAMEWORK = {
@@ -18,16 +18,18 @@ from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from django.conf import settings
 from django.conf.urls.static import static
-from courses.views import CourseListView
+from courses.views import course_list, CacheTelemetryView
 
 urlpatterns = [
+    # before admin/ so the admin doesn't take the url
+    path('admin/cache/', admin.site.admin_view(CacheTelemetryView.as_view()), name='cache_telemetry'),
     path('admin/', admin.site.urls),
     path('course/', include('courses.urls', namespace='courses')),
     path('students/', include('students.urls', namespace='students')),
     path('api/', include('courses.api.urls')),
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='logout'),
-    path('', CourseListView.as_view(), name="course_list"),
+    path('', course_list, name="course_list"),
 ]
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
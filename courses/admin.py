@@ -16,6 +16,6 @@ class ModuleInline(admin.StackedInline):
 class CouseAdmin(admin.ModelAdmin):
     list_display = ['title', 'subject', 'created']
     list_filter  = ['created', 'subject']
-    search_fields = ['title', 'subject', 'overview']
+    search_fields = ['title', 'subject__title', 'overview']
     prepopulated_fields = {'title': ('slug', )}
     inlines = [ModuleInline]
\ No newline at end of file
@@ -0,0 +1,80 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+
+# cursor pagination:
+# the next page starts right after the (created, id) of the last course of the page
+# instead of using an OFFSET, so every page costs the same however big the catalog is
+# the CursorPagination of rest framework only filters on the first field of the ordering
+# and skips the courses created at the same moment with an offset, here the cursor is
+# the pair itself: WHERE created >= %s AND (created > %s OR id > %s), a range of the
+# (created, id) index which starts right at the cursor, however many courses share the date
+
+
+class CourseCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # same as Course.Meta.ordering, the id breaks the ties between equal dates
+    ordering = ('created', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+
+        if reverse:
+            queryset = queryset.order_by('-created', '-id')
+        else:
+            queryset = queryset.order_by('created', 'id')
+        if position is not None:
+            created, id = self.parse_position(position)
+            lookup = 'lt' if reverse else 'gt'
+            queryset = queryset.filter(
+                Q(**{'created__{}e'.format(lookup): created}),
+                Q(**{'created__' + lookup: created}) | Q(**{'id__' + lookup: id})
+            )
+
+        # one more course tells if there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # after the last course of the page, or from the same place when the page is empty
+        position = self.get_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.get_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_position(self, course):
+        return '{}|{}'.format(course.created.isoformat(), course.id)
+
+    def parse_position(self, position):
+        created, _, id = position.rpartition('|')
+        try:
+            created, id = parse_datetime(created), int(id)
+        except ValueError:
+            created = None
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, id
@@ -6,10 +6,24 @@
     # has object permission --> instance permission check 
 
 from rest_framework.permissions import BasePermission
+from students.enrollment import is_enrolled
 
 class IsEnrolled(BasePermission):
+    message = 'You are not enrolled in this course.'
+
+    def has_permission(self, request, view):
+        # on a course route the pk of the url is enough, no need to load the course first
+        pk = view.kwargs.get('pk')
+        if pk is None:
+            return True
+        try:
+            return is_enrolled(request.user, pk)
+        except ValueError:
+            return False
+
     def has_object_permission(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
+        # the cached enrollment index, no query
+        return is_enrolled(request.user, obj.id)
         
 
 
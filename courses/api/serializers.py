@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from ..models import Subject, Course, Module, Content
+from django.db import models
+from ..models import Subject, Course, Module, Content, Upload
+from .. import uploads
+from ..cache import record_dependencies, module_namespace
+from ..rendering import prefetch_rendered
 
 #   PARSER AND RENDERS
 # serialized data rendered in a specific format 
@@ -10,11 +14,22 @@ class ItemRelatedField(serializers.RelatedField):
         return value.render()
 
 
+class ContentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        contents = list(data.all() if isinstance(data, models.Manager) else data)
+        # the cached responses which include these contents depend on their modules
+        record_dependencies(*{module_namespace(content.module_id) for content in contents})
+        # render (or read from the cache) the html of all the items at once
+        prefetch_rendered(content.item for content in contents)
+        return super(ContentListSerializer, self).to_representation(contents)
+
+
 class ContentSerializer(serializers.ModelSerializer):
     item = ItemRelatedField(read_only=True)
     class Meta:
         model = Content
         fields = ('order', 'item')
+        list_serializer_class = ContentListSerializer
 
 
 class ModuleSerializer(serializers.ModelSerializer):
@@ -47,4 +62,29 @@ class CourseWithContentsSerializer(CourseSerializer):
     modules = ModuleWithContentsSerializer(many=True)
     class Meta:
         model = Course
-        fields = ('id', "owner", "subject", "title", "slug", "overview", "created")
+        fields = ('id', "owner", "subject", "title", "slug", "overview", "created", "modules")
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.SerializerMethodField()
+    complete = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'module', 'model_name', 'title', 'filename', 'size', 'offset', 'chunk_size',
+                  'complete', 'content')
+        read_only_fields = ('offset', 'content')
+
+    def get_chunk_size(self, obj):
+        return uploads.CHUNK_SIZE
+
+    def validate_module(self, module):
+        # the same check as ContentCreateUpdateView, only in the modules of your own courses
+        if module.course.owner_id != self.context['request'].user.id:
+            raise serializers.ValidationError('You are not the owner of this module.')
+        return module
+
+    def validate_size(self, size):
+        if not 0 < size <= uploads.MAX_SIZE:
+            raise serializers.ValidationError('The size must be between 1 and {} bytes.'.format(uploads.MAX_SIZE))
+        return size
@@ -8,6 +8,12 @@ router.register('courses', views.CourseViewSet)
 urlpatterns = [
     path('subjects/', views.SubjectListView.as_view(), name="subject_list"),
     path('subject/<int:pk>/', views.SubjectDetailView.as_view(), name="subject_detail"),
+    path('enrollments/', views.BulkEnrollView.as_view(), name="bulk_enroll"),
+    path('uploads/', views.UploadListView.as_view(), name="upload_list"),
+    path('uploads/<uuid:pk>/', views.UploadDetailView.as_view(), name="upload_detail"),
+    path('search/', views.SearchView.as_view(), name="search"),
+    path('cache/telemetry/', views.CacheTelemetryView.as_view(), name="cache_telemetry_api"),
+    path('catalog/export/', views.CatalogExportView.as_view(), name="catalog_export"),
     # path('courses/<int:pk>/enroll/', views.CourseEnrollView.as_view(), name="course_enroll"),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -5,15 +5,29 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import generics
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
 from rest_framework.authentication import BasicAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action 
 
-from ..models import Subject, Course
+from ..models import Subject, Course, Content, Upload
+from .. import uploads
+from ..export import spool_ndjson
+from ..search import search
+from ..telemetry import collect, ITEM_SIZE_LIMIT
+from ..cache import get_tracked, build_tracked, generations_etag, course_namespace
+from students.enrollment import bulk_enroll
+from .pagination import CourseCursorPagination
 from .permissions import IsEnrolled
-from .serializers import SubjectSerializer,\
-    SubjectSerializer, CourseSerializer,\
-    CourseWithContentsSerializer
+from .serializers import SubjectSerializer, CourseSerializer, CourseWithContentsSerializer, UploadSerializer
 
 # some of the build in permession system in rest framework are:
     # allow any --> un restricted access regardless if the user is authenticated or not
@@ -27,6 +41,9 @@ from .serializers import SubjectSerializer,\
         # if users are dinied permissins the will get an http error code 
     
 
+COURSE_CONTENTS_TIMEOUT = getattr(settings, 'COURSE_CONTENTS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
 class SubjectListView(generics.ListAPIView):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
@@ -40,6 +57,14 @@ class SubjectDetailView(generics.RetrieveAPIView):
 class CourseViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CourseCursorPagination
+
+    def get_queryset(self):
+        qs = super(CourseViewSet, self).get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # one query for the modules of the whole page instead of one per course
+            qs = qs.prefetch_related('modules')
+        return qs
 
     # the decorator allow as to write custom attribute to the action
     @action(
@@ -58,10 +83,163 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         methods=['get'],
         serializer_class = CourseWithContentsSerializer,
         authentication_classes = [BasicAuthentication],
+        # IsEnrolled checks the pk of the url in the enrollment index, the course isn't loaded
         permission_classes = [IsAuthenticated, IsEnrolled]
     )
-    def contents(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+    def contents(self, request, pk=None, *args, **kwargs):
+        # the json is cached per course version: the course, its modules, their contents
+        # and items are all dependencies of the entry (see courses/cache.py)
+        key = 'course_contents:{}'.format(pk)
+        content, generations = get_tracked(key)
+        if generations is not None:
+            etag = generations_etag(key, generations)
+            # the client already has this version: no database and no serialization
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                return self.not_modified(etag)
+        else:
+            content, generations = build_tracked(
+                key, lambda: self.render_contents(pk), COURSE_CONTENTS_TIMEOUT,
+                course_namespace(pk)
+            )
+            if content is None:
+                raise Http404
+            etag = generations_etag(key, generations)
+        response = HttpResponse(content, content_type='application/json')
+        return self.conditional(response, etag)
+
+    def render_contents(self, pk):
+        # modules, contents and the items of each content type are loaded in bulk
+        # instead of one query per module, per content and per item
+        course = self.get_queryset().prefetch_related(
+            Prefetch('modules__contents', queryset=Content.objects.with_items())
+        ).filter(pk=pk).first()
+        if course is None:
+            return None
+        serializer = self.get_serializer(course)
+        return JSONRenderer().render(serializer.data)
+
+    def not_modified(self, etag):
+        return self.conditional(HttpResponseNotModified(), etag)
+
+    def conditional(self, response, etag):
+        response['ETag'] = etag
+        # the permission check is done for every user, so no shared cache (like the site wide
+        # cache middleware) may keep the response, and clients must revalidate with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class CatalogExportView(APIView):
+    # the whole catalog as NDJSON, read in the worker thread of the view (see courses/export.py)
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return FileResponse(spool_ndjson(), as_attachment=True, filename='catalog.ndjson',
+                            content_type='application/x-ndjson')
+
+
+@method_decorator(never_cache, name='dispatch')
+class SearchView(APIView):
+    # ?q=<words>&limit=<at most 50>, the best matches first
+    # anybody can search, the text contents are only found in the user's own courses
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 50)
+        except ValueError:
+            limit = 20
+        results = search(query, limit, request.user) if query else []
+        for result in results:
+            # the marks are html, the api returns them as plain strings
+            result['title'] = str(result['title'])
+            result['snippet'] = str(result['snippet'])
+        return Response({'query': query, 'results': results})
+
+
+@method_decorator(never_cache, name='dispatch')
+class CacheTelemetryView(APIView):
+    # hits, misses, latency and sizes per cache namespace, for the scrapers
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return Response({'item_size_limit': ITEM_SIZE_LIMIT, 'namespaces': collect()})
+
+
+class UploadListView(APIView):
+    # start a chunked upload of a file or an image (see courses/uploads.py)
+    # {"module": 1, "model_name": "file", "title": "...", "filename": "lecture.mp4", "size": 123456789}
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = UploadSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(owner=request.user)
+        return Response(serializer.data, status=201, headers={
+            'Location': reverse('upload_detail', args=[upload.pk]),
+            'Upload-Offset': upload.offset,
+        })
+
+
+class UploadDetailView(APIView):
+    # GET: where to go on from, PUT: the next chunk (raw body, Upload-Offset header), DELETE: give up
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, pk):
+        return get_object_or_404(Upload, pk=pk, owner=request.user)
+
+    def get(self, request, pk, format=None):
+        upload = self.get_upload(request, pk)
+        return Response(UploadSerializer(upload).data, headers={'Upload-Offset': upload.offset})
+
+    def put(self, request, pk, format=None):
+        upload = self.get_upload(request, pk)
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return Response({'detail': 'Send the Upload-Offset and Content-Length headers.'}, status=400)
+        # optional "Upload-Checksum: sha256 <hex digest of the chunk>"
+        algorithm, _, sha256 = request.META.get('HTTP_UPLOAD_CHECKSUM', '').partition(' ')
+        try:
+            # the body is read from the request stream block by block, the parsers never see it
+            content = uploads.append_chunk(upload, offset, request.stream, length,
+                                           sha256 if algorithm == 'sha256' else None)
+        except uploads.ChunkConflict as error:
+            return Response({'detail': str(error), 'offset': upload.offset}, status=409,
+                            headers={'Upload-Offset': upload.offset})
+        except uploads.UploadError as error:
+            return Response({'detail': str(error), 'offset': upload.offset}, status=400,
+                            headers={'Upload-Offset': upload.offset})
+        data = UploadSerializer(upload).data
+        if content is not None:
+            data['checksum'] = uploads.checksum(upload)
+        return Response(data, headers={'Upload-Offset': upload.offset})
+
+    def delete(self, request, pk, format=None):
+        uploads.discard(self.get_upload(request, pk))
+        return Response(status=204)
+
+
+class BulkEnrollView(APIView):
+    # {"courses": [1], "users": [4, 5, 6, ...]} or {"users": [4], "courses": [1, 2, 3, ...]}
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, format=None):
+        courses = request.data.get('courses')
+        users = request.data.get('users')
+        if not isinstance(courses, list) or not isinstance(users, list) \
+                or not courses or not users or (len(courses) > 1 and len(users) > 1):
+            return Response(
+                {'detail': 'Send a list of "courses" and a list of "users", one of them with a single id.'},
+                status=400
+            )
+        try:
+            result = bulk_enroll(courses, users)
+        except (TypeError, ValueError):
+            return Response({'detail': 'The ids must be integers.'}, status=400)
+        return Response(result)
 
 
 # building Custom:
@@ -0,0 +1,202 @@
+import bisect
+import collections
+import hashlib
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from pymemcache import serde
+from pymemcache.client.hash import HashClient
+
+from courses.telemetry import telemetry, telemetry_serde
+
+# pooled memcached backend:
+    # the keys are spread over all the nodes of LOCATION with a consistent hash ring
+    # (ketama), adding or removing a node only moves about 1/n of the keys
+    # every node has a pool of connections shared by all the threads of the process
+    # get_many/set_many/delete_many send one pipelined request per node
+    # the hits, misses, latency and sizes are recorded per key namespace (courses/telemetry.py),
+    # 'telemetry': False in OPTIONS turns it off
+# usage:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'courses.backends.memcached.PooledMemcachedCache',
+#         'LOCATION': ['10.0.0.1:11211', '10.0.0.2:11211'],
+#         'OPTIONS': {'max_pool_size': 32},
+#     }
+# }
+
+
+class KetamaRing(object):
+    """Consistent hash ring with `points` virtual points per node (the ketama layout)."""
+
+    def __init__(self, points=160):
+        self.points = points
+        self.nodes = []
+        # (sorted points, node of every point), replaced as a whole so get_node() never
+        # sees the points of one ring with the nodes of another
+        self._ring = ((), ())
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(value):
+        if isinstance(value, str):
+            value = value.encode()
+        return hashlib.md5(value).digest()
+
+    def _node_hashes(self, node):
+        # every md5 digest gives 4 points of the ring
+        for i in range(self.points // 4):
+            digest = self._digest('{}-{}'.format(node, i))
+            for j in range(4):
+                yield int.from_bytes(digest[j * 4:j * 4 + 4], 'little')
+
+    def _build(self):
+        # HashClient removes and adds the dead nodes from the request threads
+        ring = sorted((point, node) for node in self.nodes for point in self._node_hashes(node))
+        self._ring = (tuple(point for point, node in ring), tuple(node for point, node in ring))
+
+    def add_node(self, node):
+        with self._lock:
+            if node not in self.nodes:
+                self.nodes = self.nodes + [node]
+                self._build()
+
+    def remove_node(self, node):
+        with self._lock:
+            if node not in self.nodes:
+                raise ValueError('No such node {} to remove'.format(node))
+            self.nodes = [other for other in self.nodes if other != node]
+            self._build()
+
+    def get_node(self, key):
+        hashes, nodes = self._ring
+        if not nodes:
+            return None
+        point = int.from_bytes(self._digest(key)[:4], 'little')
+        return nodes[bisect.bisect(hashes, point) % len(nodes)]
+
+
+class RingClient(HashClient):
+    """HashClient which also pipelines delete_many and reports the stats of every node."""
+
+    def delete_many(self, keys, *args, **kwargs):
+        batches = collections.defaultdict(list)
+        for key in keys:
+            client = self._get_client(key)
+            if client is not None:
+                batches[client.server].append(key)
+        for server, keys in batches.items():
+            client = self.clients[self._make_client_key(server)]
+            self._safely_run_func(client, client.delete_many, False, keys, *args, **kwargs)
+        return True
+
+    delete_multi = delete_many
+
+    def get_stats(self):
+        # same format as python-memcached, used by memcache_status in the admin
+        stats = []
+        for name, client in self.clients.items():
+            values = self._safely_run_func(client, client.stats, {})
+            stats.append((name, {
+                key.decode() if isinstance(key, bytes) else key: value.decode() if isinstance(value, bytes) else value
+                for key, value in values.items()
+            }))
+        return stats
+
+
+# django creates one cache object per thread, the clients (and their pools) are shared
+_clients = {}
+_clients_lock = threading.Lock()
+_missing = object()
+
+
+class PooledMemcachedCache(BaseMemcachedCache):
+    "memcached through pymemcache, with connection pools and a consistent hash ring"
+
+    def __init__(self, server, params):
+        import pymemcache
+        super(PooledMemcachedCache, self).__init__(
+            server, params, library=pymemcache, value_not_found_exception=KeyError
+        )
+        options = {
+            'use_pooling': True,
+            'max_pool_size': 16,
+            'connect_timeout': 1,
+            'timeout': 1,
+            # like python-memcached, a node which is down behaves like an empty cache
+            'ignore_exc': True,
+            'retry_attempts': 2,
+            'dead_timeout': 30,
+            'allow_unicode_keys': True,
+            'default_noreply': False,
+            'serde': serde.pickle_serde,
+        }
+        options.update(self._options)
+        points = options.pop('ring_points', 160)
+        self._telemetry = options.pop('telemetry', True)
+        if self._telemetry:
+            # same pickle format, it only measures the values
+            options['serde'] = telemetry_serde
+        options['hasher'] = lambda: KetamaRing(points)
+        self._options = options
+        self._client_key = (tuple(self._servers), points, tuple(sorted(
+            (name, repr(value)) for name, value in options.items() if name != 'hasher'
+        )))
+
+    @property
+    def _cache(self):
+        client = _clients.get(self._client_key)
+        if client is None:
+            with _clients_lock:
+                client = _clients.get(self._client_key)
+                if client is None:
+                    client = _clients[self._client_key] = RingClient(self._servers, **self._options)
+        return client
+
+    def get(self, key, default=None, version=None):
+        made_key = self.make_key(key, version=version)
+        self.validate_key(made_key)
+        if not self._telemetry:
+            return self._cache.get(made_key, default)
+        start = time.perf_counter()
+        value = self._cache.get(made_key, _missing)
+        found = () if value is _missing else (key,)
+        telemetry.record_reads([key], found, time.perf_counter() - start)
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None):
+        if not self._telemetry:
+            return super(PooledMemcachedCache, self).get_many(keys, version=version)
+        keys = list(keys)
+        start = time.perf_counter()
+        values = super(PooledMemcachedCache, self).get_many(keys, version=version)
+        telemetry.record_reads(keys, values, time.perf_counter() - start)
+        return values
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._cache.touch(key, self.get_backend_timeout(timeout)))
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        # memcached doesn't support a negative delta
+        if delta < 0:
+            val = self._cache.decr(key, -delta)
+        else:
+            val = self._cache.incr(key, delta)
+        # pymemcache returns None for a missing key and False when the node is down,
+        # in both cases the caller must not use the value
+        if val is None or val is False:
+            raise ValueError("Key '%s' not found" % key)
+        return val
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def close(self, **kwargs):
+        # the connections stay in the pools for the next requests
+        pass
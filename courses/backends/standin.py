@@ -0,0 +1,294 @@
+import socket
+import socketserver
+import threading
+import time
+
+# memcached stand-in:
+# a small in-memory server which speaks the memcached text protocol (the commands
+# used by pymemcache and python-memcached), so the cache backends can be tested and
+# benchmarked without a real memcached.
+#     server = MemcachedStandIn().start()
+#     server.location  # '127.0.0.1:<free port>'
+#     ...
+#     server.stop()
+
+RELATIVE_EXPIRY_LIMIT = 60 * 60 * 24 * 30
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super(_Handler, self).setup()
+        self.server.standin._connections.add(self.request)
+
+    def finish(self):
+        self.server.standin._connections.discard(self.request)
+        super(_Handler, self).finish()
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0].decode().lower()
+            method = getattr(self, 'cmd_' + command, None)
+            if method is None:
+                self.reply(b'ERROR')
+                continue
+            try:
+                if method(parts[1:]) is False:
+                    return
+            except (ValueError, IndexError):
+                self.reply(b'CLIENT_ERROR bad command line format')
+
+    @property
+    def store(self):
+        return self.server.standin
+
+    def reply(self, *lines, noreply=False):
+        if not noreply:
+            self.wfile.write(b''.join(line + b'\r\n' for line in lines))
+
+    def cmd_get(self, keys):
+        self.store.count('cmd_get', len(keys))
+        lines = []
+        for key in keys:
+            item = self.store.read(key)
+            if item is None:
+                continue
+            flags, value, cas = item
+            lines.append(b'VALUE ' + key + b' ' + str(flags).encode() + b' ' + str(len(value)).encode())
+            lines.append(value)
+        self.reply(*lines + [b'END'])
+
+    def cmd_gets(self, keys):
+        self.store.count('cmd_get', len(keys))
+        lines = []
+        for key in keys:
+            item = self.store.read(key)
+            if item is None:
+                continue
+            flags, value, cas = item
+            lines.append(b' '.join([b'VALUE', key, str(flags).encode(), str(len(value)).encode(),
+                                    str(cas).encode()]))
+            lines.append(value)
+        self.reply(*lines + [b'END'])
+
+    def _storage(self, mode, args, cas=None):
+        key, flags, exptime, size = args[0], int(args[1]), int(args[2]), int(args[3])
+        noreply = args[-1] == b'noreply'
+        value = self.rfile.read(size + 2)[:size]
+        self.store.count('cmd_set')
+        result = self.store.write(mode, key, flags, exptime, value, cas)
+        self.reply(result, noreply=noreply)
+
+    def cmd_set(self, args):
+        self._storage('set', args)
+
+    def cmd_add(self, args):
+        self._storage('add', args)
+
+    def cmd_replace(self, args):
+        self._storage('replace', args)
+
+    def cmd_append(self, args):
+        self._storage('append', args)
+
+    def cmd_prepend(self, args):
+        self._storage('prepend', args)
+
+    def cmd_cas(self, args):
+        self._storage('cas', args[:4] + args[5:], cas=int(args[4]))
+
+    def cmd_delete(self, args):
+        noreply = args[-1] == b'noreply'
+        found = self.store.delete(args[0])
+        self.reply(b'DELETED' if found else b'NOT_FOUND', noreply=noreply)
+
+    def cmd_incr(self, args):
+        self._arithmetic(args, 1)
+
+    def cmd_decr(self, args):
+        self._arithmetic(args, -1)
+
+    def _arithmetic(self, args, sign):
+        noreply = args[-1] == b'noreply'
+        value = self.store.arithmetic(args[0], sign * int(args[1]))
+        self.reply(b'NOT_FOUND' if value is None else str(value).encode(), noreply=noreply)
+
+    def cmd_touch(self, args):
+        noreply = args[-1] == b'noreply'
+        found = self.store.touch(args[0], int(args[1]))
+        self.reply(b'TOUCHED' if found else b'NOT_FOUND', noreply=noreply)
+
+    def cmd_flush_all(self, args):
+        noreply = bool(args) and args[-1] == b'noreply'
+        self.store.flush()
+        self.reply(b'OK', noreply=noreply)
+
+    def cmd_version(self, args):
+        self.reply(b'VERSION 1.6.0-standin')
+
+    def cmd_stats(self, args):
+        lines = [
+            b'STAT ' + name.encode() + b' ' + str(value).encode()
+            for name, value in sorted(self.store.stats().items())
+        ]
+        self.reply(*lines + [b'END'])
+
+    def cmd_quit(self, args):
+        return False
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MemcachedStandIn(object):
+    """An in-memory memcached compatible server running in a background thread."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._items = {}
+        self._lock = threading.Lock()
+        self._cas = 0
+        self._counters = {}
+        self._connections = set()
+        self._server = None
+
+    # server
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.standin = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        # like a real server going down, the open connections are closed too
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def location(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # storage
+
+    @staticmethod
+    def _expires_at(exptime):
+        if exptime == 0:
+            return None
+        if exptime < 0:
+            return 0
+        if exptime > RELATIVE_EXPIRY_LIMIT:
+            return exptime
+        return time.time() + exptime
+
+    def _live(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at = item[3]
+        if expires_at is not None and expires_at <= time.time():
+            del self._items[key]
+            return None
+        return item
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def read(self, key):
+        with self._lock:
+            item = self._live(key)
+            name = 'get_misses' if item is None else 'get_hits'
+            self._counters[name] = self._counters.get(name, 0) + 1
+            if item is None:
+                return None
+            flags, value, cas, expires_at = item
+            return flags, value, cas
+
+    def write(self, mode, key, flags, exptime, value, cas=None):
+        with self._lock:
+            item = self._live(key)
+            if mode == 'add' and item is not None:
+                return b'NOT_STORED'
+            if mode in ('replace', 'append', 'prepend') and item is None:
+                return b'NOT_STORED'
+            if mode == 'cas':
+                if item is None:
+                    return b'NOT_FOUND'
+                if item[2] != cas:
+                    return b'EXISTS'
+            if mode == 'append':
+                flags, value, exptime_at = item[0], item[1] + value, item[3]
+            elif mode == 'prepend':
+                flags, value, exptime_at = item[0], value + item[1], item[3]
+            else:
+                exptime_at = self._expires_at(exptime)
+            self._cas += 1
+            self._items[key] = (flags, value, self._cas, exptime_at)
+            return b'STORED'
+
+    def delete(self, key):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            del self._items[key]
+            return True
+
+    def arithmetic(self, key, delta):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return None
+            # memcached never goes under 0 and wraps at 64 bits
+            value = max(int(item[1]) + delta, 0) % 2 ** 64
+            self._cas += 1
+            self._items[key] = (item[0], str(value).encode(), self._cas, item[3])
+            return value
+
+    def touch(self, key, exptime):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return False
+            self._items[key] = item[:3] + (self._expires_at(exptime),)
+            return True
+
+    def flush(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['curr_items'] = len(self._items)
+            stats['bytes'] = sum(len(item[1]) for item in self._items.values())
+        for name in ('cmd_get', 'cmd_set', 'get_hits', 'get_misses'):
+            stats.setdefault(name, 0)
+        return stats
+
+    def keys(self):
+        with self._lock:
+            return [key.decode() for key in self._items]
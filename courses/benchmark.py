@@ -0,0 +1,117 @@
+import base64
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from courses.counters import reconcile
+from courses.models import Subject, Course, Module, Content, Text
+from students.enrollment import bulk_enroll
+
+# the seeded dataset and the main endpoints, shared by the benchmark_* and
+# audit_query_plans commands (they all roll the dataset back when they are done)
+
+PASSWORD = 'benchmark'
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """A transaction which is always rolled back, whatever the block wrote is gone after it."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def seed(subjects=10, courses=200, modules=6, contents=8, students=100, targets=5):
+    """Create a dataset of `courses` courses, the first `targets` ones with `students` students."""
+    owner = User.objects.create_user('benchmark-owner', first_name='Bench', last_name='Mark')
+    User.objects.bulk_create([
+        User(username='benchmark-student-{}'.format(i)) for i in range(students)
+    ])
+    student_list = list(User.objects.filter(username__startswith='benchmark-student-'))
+    if student_list:
+        student_list[0].set_password(PASSWORD)
+        student_list[0].save()
+    # bulk_create doesn't set the primary keys on every database, so i read the rows back
+    Subject.objects.bulk_create([
+        Subject(title='Subject {}'.format(i), slug='benchmark-subject-{}'.format(i))
+        for i in range(subjects)
+    ])
+    subject_list = list(Subject.objects.filter(slug__startswith='benchmark-subject-'))
+    Course.objects.bulk_create([
+        Course(owner=owner, subject=subject_list[i % len(subject_list)],
+               title='Course {}'.format(i), slug='benchmark-course-{}'.format(i),
+               overview='overview ' * 50)
+        for i in range(courses)
+    ], batch_size=500)
+    course_list = list(Course.objects.filter(owner=owner).order_by('id'))
+    Module.objects.bulk_create([
+        Module(course=course, title='Module {}'.format(i), description='description ' * 20, order=i)
+        for course in course_list for i in range(modules)
+    ], batch_size=500)
+    module_list = list(Module.objects.filter(course__owner=owner).order_by('id'))
+    Text.objects.bulk_create([
+        Text(owner=owner, title='Text {}'.format(i), content='lorem ipsum ' * 100)
+        for i in range(len(module_list) * contents)
+    ], batch_size=500)
+    texts = list(Text.objects.filter(owner=owner).order_by('id').values_list('id', flat=True))
+    text_type = ContentType.objects.get_for_model(Text)
+    Content.objects.bulk_create([
+        Content(module=module, content_type=text_type, order=i,
+                object_id=texts[index * contents + i])
+        for index, module in enumerate(module_list) for i in range(contents)
+    ], batch_size=500)
+    for course in course_list[:targets]:
+        bulk_enroll([course.id], [student.id for student in student_list])
+    # bulk_create doesn't send the signals which keep the counters
+    reconcile()
+    return {
+        'owner': owner,
+        'student': student_list[0] if student_list else None,
+        'subjects': subject_list,
+        'courses': course_list,
+    }
+
+
+def endpoints(dataset, targets):
+    """Return [(name, client, urls)] of the main pages and api endpoints of the dataset."""
+    anonymous = Client()
+    instructor = Client()
+    instructor.force_login(dataset['owner'])
+    student = Client()
+    student.force_login(dataset['student'])
+    # the contents endpoint only accepts basic authentication
+    credentials = base64.b64encode('{}:{}'.format(dataset['student'].username, PASSWORD).encode())
+    api_student = Client(HTTP_AUTHORIZATION='Basic {}'.format(credentials.decode()))
+    subjects = dataset['subjects'][:targets]
+    courses = dataset['courses'][:targets]
+    modules = [course.modules.all()[0] for course in courses]
+    return [
+        ('course_list', anonymous, [reverse('course_list')]),
+        ('course_list_subject', anonymous, [
+            reverse('courses:course_list_subject', args=[subject.slug]) for subject in subjects
+        ]),
+        ('course_detail', anonymous, [
+            reverse('courses:course_detail', args=[course.slug]) for course in courses
+        ]),
+        ('student_course_detail', student, [
+            reverse('students:student_course_detail', args=[course.id]) for course in courses
+        ]),
+        ('module_content_list', instructor, [
+            reverse('courses:module_content_list', args=[module.id]) for module in modules
+        ]),
+        ('api_course_list', anonymous, ['/api/courses/']),
+        ('api_course_contents', api_student, [
+            '/api/courses/{}/contents/'.format(course.id) for course in courses
+        ]),
+    ]
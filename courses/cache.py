@@ -0,0 +1,425 @@
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+# versioned keys (generation based invalidation):
+    # every group of cached entries belongs to one or more namespaces
+    # each namespace has a generation counter stored in the cache itself
+    # the generation is part of the real cache key, so bumping it makes the old entries unreachable
+    # the old entries are never deleted, memcached evicts them when it needs the memory
+# like this we can keep a very long timeout and still see the changes immediately
+
+GENERATION_KEY = 'generation:{}'
+
+CATALOG_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# local (in process) tier, see get_or_compute()
+LOCAL_CACHE_MAX_ENTRIES = getattr(settings, 'LOCAL_CACHE_MAX_ENTRIES', 256)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'LOCAL_CACHE_TIMEOUT', 30)
+# how long (in ms) a process trusts the generations it read from memcached
+GENERATION_CHECK_INTERVAL = getattr(settings, 'GENERATION_CHECK_INTERVAL', 500)
+
+# stampede protection, see get_or_compute()
+COMPUTE_LOCK_TIMEOUT = getattr(settings, 'COMPUTE_LOCK_TIMEOUT', 30)
+COMPUTE_WAIT = 2
+
+
+def _seed():
+    # a fresh generation starts from the current time in milliseconds,
+    # so if memcached evicts (or restarts and loses) a counter we never reuse an old generation
+    return int(time.time() * 1000)
+
+
+def get_generations(*namespaces):
+    """Return a dict mapping every namespace to its current generation."""
+    keys = {GENERATION_KEY.format(ns): ns for ns in namespaces}
+    found = cache.get_many(keys.keys())
+    generations = {}
+    for key, ns in keys.items():
+        value = found.get(key)
+        if value is None:
+            value = _seed()
+            # add() only stores the value if nobody did it before us
+            if not cache.add(key, value, None):
+                value = cache.get(key, value)
+        generations[ns] = value
+    return generations
+
+
+def versioned_key(key, *namespaces, local=False):
+    """Build the real cache key of `key` from the generations of its namespaces.
+
+    with local=True the generations may be up to GENERATION_CHECK_INTERVAL ms old.
+    """
+    if local:
+        generations = get_local_generations(*namespaces)
+    else:
+        generations = get_generations(*namespaces)
+    version = '.'.join(str(generations[ns]) for ns in namespaces)
+    return '{}:{}'.format(key, version)
+
+
+def bump(*namespaces):
+    """Invalidate every entry stored under the given namespaces."""
+    for ns in set(namespaces):
+        key = GENERATION_KEY.format(ns)
+        # this process sees its own changes right away, the others within GENERATION_CHECK_INTERVAL
+        local_generations.delete(ns)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the counter is not in the cache, so start a new one
+            cache.set(key, _seed(), None)
+
+
+class LocalCache(object):
+    """A small thread safe LRU with a timeout per entry, private to the process."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                # the least recently used entry goes first
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# two tier cache for the hot catalog keys (see get_or_compute()):
+    # L1 is a LocalCache in every process, L2 is memcached (the default cache)
+    # the L1 entries are stored under the versioned keys, so they never need to be invalidated,
+    # a bump only makes their keys unreachable
+    # to build the versioned key without a round-trip, the process keeps the generations it read
+    # for GENERATION_CHECK_INTERVAL ms (that's the cross-process invalidation signal)
+# a hit on a hot key doesn't need any network i/o
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_TIMEOUT)
+local_generations = LocalCache(LOCAL_CACHE_MAX_ENTRIES, GENERATION_CHECK_INTERVAL / 1000)
+
+
+def get_local_generations(*namespaces):
+    """Like get_generations() but the generations may be up to GENERATION_CHECK_INTERVAL ms old."""
+    generations = {}
+    missing = []
+    for ns in namespaces:
+        value = local_generations.get(ns)
+        if value is None:
+            missing.append(ns)
+        else:
+            generations[ns] = value
+    if missing:
+        for ns, value in get_generations(*missing).items():
+            local_generations.set(ns, value)
+            generations[ns] = value
+    return generations
+
+
+# stampede protection:
+    # the entries of get_or_compute() remember how long they took to compute (delta) and when
+    # they expire. before they expire, every reader rolls the dice and the probability to
+    # recompute grows as the expiry gets closer and the computation gets longer (XFetch),
+    # so a hot key is usually refreshed by one request before it expires
+    # only the worker holding the lock key computes, the others keep serving the previous
+    # value, which is also stored under a stable key (not versioned) for when the namespaces
+    # were bumped and the versioned key is simply missing
+    # the others only wait while a lock is really held: when memcached is unreachable every
+    # add() fails with no lock behind it, then the value is computed right away
+# https://cseweb.ucsd.edu/~avattani/papers/cache_stampede.pdf
+
+
+def _should_refresh(delta, expires_at, beta):
+    # -log(random()) is exponentially distributed, so most of the time the entry is used as it is
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _store(real_key, stale_key, value, start, timeout):
+    delta = time.time() - start
+    entry = (value, delta, start + timeout)
+    # memcached keeps the versioned entry a bit after its logical expiry, so the early
+    # recomputation has the time to run. the stale copy is kept until memcached evicts it
+    cache.set(real_key, entry, timeout + max(int(delta * 10), 1))
+    cache.set(stale_key, entry, None)
+    local_cache.set(real_key, entry)
+
+
+def _compute(real_key, stale_key, compute, timeout):
+    start = time.time()
+    value = compute()
+    _store(real_key, stale_key, value, start, timeout)
+    return value
+
+
+HIT, COMPUTE, WAIT, DOWN = 'hit', 'compute', 'wait', 'down'
+
+
+def _lookup(key, namespaces, beta):
+    """The cache side of get_or_compute(), returns (state, value, real_key).
+
+    HIT: value is the value to serve, COMPUTE: the caller holds the lock and computes,
+    WAIT: nothing to serve yet and another worker is computing,
+    DOWN: no lock could be taken and there is none, the cache is not available.
+    """
+    real_key = versioned_key(key, *namespaces, local=True)
+    lock_key = 'lock:{}'.format(real_key)
+    entry = local_cache.get(real_key)
+    if entry is None:
+        entry = cache.get(real_key)
+        if entry is not None:
+            local_cache.set(real_key, entry)
+    if entry is not None:
+        value, delta, expires_at = entry
+        # when someone else is already refreshing it, the current value is still good
+        if not _should_refresh(delta, expires_at, beta) or not cache.add(lock_key, 1, COMPUTE_LOCK_TIMEOUT):
+            return HIT, value, real_key
+        return COMPUTE, None, real_key
+    if cache.add(lock_key, 1, COMPUTE_LOCK_TIMEOUT):
+        return COMPUTE, None, real_key
+    stale_key = 'stale:{}'.format(key)
+    found = cache.get_many([real_key, stale_key, lock_key])
+    # the worker holding the lock may have just finished
+    entry = found.get(real_key, found.get(stale_key))
+    if entry is not None:
+        return HIT, entry[0], real_key
+    # add() failed but nobody holds the lock: memcached is unreachable (it behaves like an
+    # empty cache), waiting would only add COMPUTE_WAIT to every request
+    if lock_key not in found:
+        return DOWN, None, real_key
+    return WAIT, None, real_key
+
+
+def _poll(real_key):
+    """Check on the worker computing `real_key`, returns (done, entry).
+
+    done when its entry is there, or when the lock is gone without it (it failed or the
+    cache went down), then there is no point in waiting any longer.
+    """
+    lock_key = 'lock:{}'.format(real_key)
+    found = cache.get_many([real_key, lock_key])
+    return real_key in found or lock_key not in found, found.get(real_key)
+
+
+def get_or_compute(key, compute, timeout, *namespaces, beta=1.0):
+    """Return the value of `key` (versioned by its namespaces), compute() it when it's missing.
+
+    only one worker at a time runs compute() for a key, the others get the previous value
+    when there is one. compute() must not return None.
+    """
+    state, value, real_key = _lookup(key, namespaces, beta)
+    if state == HIT:
+        return value
+    if state == DOWN:
+        return compute()
+    if state == WAIT:
+        # nothing to serve yet (i.e. a cold cache), wait a bit for the worker holding the lock
+        deadline = time.time() + COMPUTE_WAIT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            done, entry = _poll(real_key)
+            if entry is not None:
+                return entry[0]
+            if done:
+                break
+        return compute()
+    try:
+        return _compute(real_key, 'stale:{}'.format(key), compute, timeout)
+    finally:
+        cache.delete('lock:{}'.format(real_key))
+
+
+# async views:
+    # the django cache api is synchronous, cache_io() runs a cache call in the thread pool of
+    # asyncio so an async view can wait for several lookups at the same time
+    # the pooled memcached clients are thread safe, but the orm is not: compute() always runs
+    # with sync_to_async in the thread django keeps for the database connections, and from the
+    # task of the request (asgiref 3.3 loses that thread in the tasks made by asyncio.gather)
+# aget_or_compute_many() looks all its keys up at the same time, then computes the missing ones
+# a hit in the local tier doesn't even leave the event loop
+
+
+def cache_io(func):
+    """Wrap `func` (cache calls only, never the orm) to be awaited from an async view."""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+def _local_lookup(key, namespaces, beta):
+    # the value when the generations and the entry are all in the local tier, without i/o
+    generations = [local_generations.get(ns) for ns in namespaces]
+    if None in generations:
+        return None
+    entry = local_cache.get('{}:{}'.format(key, '.'.join(str(generation) for generation in generations)))
+    if entry is None or _should_refresh(entry[1], entry[2], beta):
+        return None
+    return entry[0]
+
+
+async def aget_or_compute_many(*lookups, beta=1.0):
+    """get_or_compute() of every (key, compute, timeout, namespaces) in `lookups`, for the async views.
+
+    returns the values in the same order. the cache lookups run at the same time, the missing
+    values are computed one after the other.
+    """
+    values = [_local_lookup(key, namespaces, beta) for key, compute, timeout, namespaces in lookups]
+    missing = [i for i, value in enumerate(values) if value is None]
+    states = await asyncio.gather(*[
+        cache_io(_lookup)(lookups[i][0], lookups[i][3], beta) for i in missing
+    ])
+    for i, (state, value, real_key) in zip(missing, states):
+        key, compute, timeout, namespaces = lookups[i]
+        if state == WAIT:
+            deadline = time.time() + COMPUTE_WAIT
+            while time.time() < deadline:
+                # the event loop serves the other requests in the meantime
+                await asyncio.sleep(0.05)
+                done, entry = await cache_io(_poll)(real_key)
+                if entry is not None:
+                    value = entry[0]
+                if done:
+                    break
+            if value is None:
+                value = await sync_to_async(compute)()
+        elif state == DOWN:
+            value = await sync_to_async(compute)()
+        elif state == COMPUTE:
+            try:
+                start = time.time()
+                value = await sync_to_async(compute)()
+                await cache_io(_store)(real_key, 'stale:{}'.format(key), value, start, timeout)
+            finally:
+                await cache_io(cache.delete)('lock:{}'.format(real_key))
+        values[i] = value
+    return values
+
+
+async def aget_or_compute(key, compute, timeout, *namespaces, beta=1.0):
+    """get_or_compute() for the async views."""
+    values = await aget_or_compute_many((key, compute, timeout, namespaces), beta=beta)
+    return values[0]
+
+
+def subject_namespace(subject_id):
+    return 'subject_{}'.format(subject_id)
+
+
+def course_namespace(course_id):
+    return 'course_{}'.format(course_id)
+
+
+def module_namespace(module_id):
+    return 'module_{}'.format(module_id)
+
+
+def object_namespace(obj):
+    # i.e. 'module_3', 'text_12'
+    return '{}_{}'.format(obj._meta.model_name, obj.pk)
+
+
+# dependency tracking:
+# while a cached fragment is being rendered, the code that loads the data records the
+# namespaces (and their current generations) it used. the fragment is stored together
+# with these generations and it's only served while all of them are still the same
+
+_tracking = threading.local()
+
+
+@contextmanager
+def track_dependencies():
+    stack = _tracking.__dict__.setdefault('stack', [])
+    recorded = {}
+    stack.append(recorded)
+    try:
+        yield recorded
+    finally:
+        stack.pop()
+
+
+def record_dependencies(*namespaces):
+    """Tell the fragments which are being rendered that they depend on these namespaces."""
+    stack = getattr(_tracking, 'stack', None)
+    if not stack or not namespaces:
+        return
+    generations = get_generations(*namespaces)
+    # a nested fragment also makes the outer fragments depend on the same data
+    for recorded in stack:
+        recorded.update(generations)
+
+
+def get_tracked(key):
+    """Return (value, generations) of a tracked entry, or (None, None) when it's missing or stale."""
+    cached = cache.get(key)
+    if cached is not None:
+        value, generations = cached
+        if get_generations(*generations) == generations:
+            # the outer fragments (if any) depend on the same data
+            record_dependencies(*generations)
+            return value, generations
+    return None, None
+
+
+def build_tracked(key, build, timeout, *namespaces):
+    """build() the value of `key` while recording its dependencies and store it.
+
+    build() may return None to skip caching. Returns (value, generations).
+    """
+    with track_dependencies() as generations:
+        record_dependencies(*namespaces)
+        value = build()
+    if value is not None:
+        cache.set(key, (value, generations), timeout)
+    return value, generations
+
+
+def get_or_build_tracked(key, build, timeout, *namespaces):
+    """Return the cached value of `key`, or build() it while recording its dependencies.
+
+    the value is only served while the generations of the given namespaces and of
+    everything recorded by build() are unchanged.
+    """
+    value, generations = get_tracked(key)
+    if generations is None:
+        value, generations = build_tracked(key, build, timeout, *namespaces)
+    return value
+
+
+def generations_etag(key, generations):
+    """A strong ETag which changes whenever one of the dependencies of `key` changes."""
+    version = ','.join('{}={}'.format(ns, gen) for ns, gen in sorted(generations.items()))
+    return '"{}"'.format(hashlib.md5('{}|{}'.format(key, version).encode()).hexdigest())
@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+from .models import Subject, Course
+
+# catalog snapshots:
+# instead of pickling annotated querysets (full model instances with _state and
+# everything else django keeps inside them) i store plain tuples with only the
+# fields that courses/course/list.html shows. the tuples are turned into named
+# rows when they are read back, so the template can still use `course.title`
+
+SubjectRow = namedtuple('SubjectRow', ['id', 'title', 'slug', 'total_courses'])
+CourseRow = namedtuple('CourseRow', [
+    'title', 'slug', 'subject_slug', 'subject_title', 'owner_name', 'total_modules'
+])
+
+
+def build_subjects_snapshot():
+    """Return the subjects of the catalog as a tuple of plain tuples."""
+    # the counters are columns (see courses/counters.py), no GROUP BY
+    return tuple(Subject.objects.values_list('id', 'title', 'slug', 'course_count'))
+
+
+def build_courses_snapshot(subject=None):
+    """Return the courses of the catalog (optionally of one subject) as a tuple of plain tuples."""
+    courses = Course.objects.all()
+    if subject is not None:
+        courses = courses.filter(subject=subject)
+    rows = courses.values_list(
+        'title', 'slug', 'subject__slug', 'subject__title',
+        'owner__first_name', 'owner__last_name', 'module_count'
+    )
+    # same value as User.get_full_name()
+    return tuple(
+        (title, slug, subject_slug, subject_title, '{} {}'.format(first, last).strip(), total)
+        for title, slug, subject_slug, subject_title, first, last, total in rows
+    )
+
+
+def load_subjects(snapshot):
+    return [SubjectRow._make(row) for row in snapshot]
+
+
+def load_courses(snapshot):
+    return [CourseRow._make(row) for row in snapshot]
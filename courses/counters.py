@@ -0,0 +1,58 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Subject, Course, Module, Content
+
+# denormalized counters:
+    # Subject.course_count, Course.module_count, Course.content_count and Course.student_count
+    # the signals (courses/signals.py, students/signals.py) and bulk_enroll() change them with
+    # F() updates, so two requests at the same time never lose an increment
+    # the bulk operations which don't send signals (bulk_create, queryset delete...) make them
+    # drift, `python manage.py reconcile_counters` counts everything again
+    # a counter never goes below zero, deleting a module made by bulk_create would take
+    # one from a counter which never counted it
+
+
+def _added(field, delta):
+    return Greatest(F(field) + delta, 0)
+
+
+def adjust(model, pks, field, delta):
+    """Add `delta` to the counter `field` of the given objects with one UPDATE."""
+    if delta and pks:
+        model.objects.filter(pk__in=pks).update(**{field: _added(field, delta)})
+
+
+def adjust_course_of_module(module_id, field, delta):
+    # UPDATE ... WHERE id IN (SELECT course_id FROM module ...), without loading the module
+    Course.objects.filter(modules=module_id).update(**{field: _added(field, delta)})
+
+
+def _count(model, related_field, group_field):
+    # the number of `model` rows of every OuterRef('pk'), as a subquery (0 instead of NULL)
+    rows = model.objects.filter(**{related_field: OuterRef('pk')}).order_by()\
+        .values(related_field).annotate(total=Count(group_field)).values('total')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def actual_counts():
+    """The true value of every counter, as (model, field, expression)."""
+    Enrollment = Course.students.through
+    return [
+        (Subject, 'course_count', _count(Course, 'subject', 'id')),
+        (Course, 'module_count', _count(Module, 'course', 'id')),
+        (Course, 'content_count', _count(Content, 'module__course', 'id')),
+        (Course, 'student_count', _count(Enrollment, 'course', 'user')),
+    ]
+
+
+def reconcile(dry_run=False):
+    """Fix the counters which drifted, return {'<model>.<field>': number of rows fixed}."""
+    fixed = {}
+    for model, field, actual in actual_counts():
+        drifted = list(model.objects.annotate(actual=actual).exclude(**{field: F('actual')})
+                       .values_list('pk', flat=True))
+        if drifted and not dry_run:
+            model.objects.filter(pk__in=drifted).update(**{field: actual})
+        fixed['{}.{}'.format(model._meta.model_name, field)] = len(drifted)
+    return fixed
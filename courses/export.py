@@ -0,0 +1,60 @@
+import json
+import tempfile
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Subject, Course, Module, Content
+from .api.serializers import SubjectSerializer, CourseSerializer, ModuleSerializer
+
+# streaming catalog export:
+# every subject, course, module and content is one json object (one line of NDJSON)
+# with a "type" key. the rows are read with .iterator(chunk_size=...) and written one
+# by one, so the memory stays flat however big the catalog is.
+# the fields are the same as in the api serializers (the nested modules of a course
+# are exported as their own lines, with the id of their course)
+# the api writes the lines to a temporary file before it answers: a streaming response
+# is read by the event loop under asgi, where the orm can't run, the file can
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'CATALOG_EXPORT_CHUNK_SIZE', 2000)
+
+
+def _fields(serializer_class, *extra, exclude=()):
+    return list(extra) + [f for f in serializer_class.Meta.fields if f not in exclude and f not in extra]
+
+
+def _rows(queryset, fields, chunk_size):
+    # values() skips building model instances, the pk keeps the order stable and indexed
+    return queryset.order_by('pk').values(*fields).iterator(chunk_size=chunk_size)
+
+
+def iter_catalog(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a dict for every subject, course, module and content of the catalog."""
+    exports = [
+        ('subject', Subject.objects.all(), _fields(SubjectSerializer)),
+        ('course', Course.objects.all(), _fields(CourseSerializer, exclude=('modules',))),
+        ('module', Module.objects.all(), _fields(ModuleSerializer, 'id', 'course')),
+        ('content', Content.objects.all(), ['id', 'module', 'order', 'content_type__model', 'object_id']),
+    ]
+    for record_type, queryset, fields in exports:
+        for row in _rows(queryset, fields, chunk_size):
+            if record_type == 'content':
+                row['item_type'] = row.pop('content_type__model')
+                row['item_id'] = row.pop('object_id')
+            row['type'] = record_type
+            yield row
+
+
+def iter_ndjson(chunk_size=EXPORT_CHUNK_SIZE):
+    """The catalog as NDJSON lines, datetimes are encoded like the api does."""
+    for row in iter_catalog(chunk_size):
+        yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+def spool_ndjson(chunk_size=EXPORT_CHUNK_SIZE):
+    """The catalog as NDJSON in a temporary file, ready to be read from the start."""
+    spool = tempfile.TemporaryFile()
+    for line in iter_ndjson(chunk_size):
+        spool.write(line.encode('utf-8'))
+    spool.seek(0)
+    return spool
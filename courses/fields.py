@@ -1,41 +1,159 @@
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Max
+from django.core.cache import cache
 
 # create a custom field that inherits from positive Integer Fields
-# it will provide additional behavior 
-# order object with respect to other fields 
+# it will provide additional behavior
+# order object with respect to other fields
 # automatically assign an order value when no specific order is provided
 
+# the orders are handed out by an atomic counter in the cache, one per for_fields scope (i.e.
+# one per course for the modules), so the objects of a scope created at the same time never
+# get the same order, even before any of them is committed, and an insert costs no query.
+    # the counter starts from the highest order of the scope in the database, read only when
+    # it's missing. add() makes sure only one process starts it, the others increment it
+    # the orders written without the counter (update(), bulk_reorder, an explicit order higher
+    # than the counter) drop it, right away and again once their transaction is committed, so
+    # it starts again from the database. after a loaddata or a restore clear the cache
+# the counter never expires, ORDER_COUNTER_TIMEOUT can give it a lifetime
+ORDER_COUNTER_TIMEOUT = getattr(settings, 'ORDER_COUNTER_TIMEOUT', None)
+
 class OrderField(models.PositiveIntegerField):
-    
-    # my order filed take optional for_fields parametter that to indicate the fields that 
-    # the order has to be calculated with respect to  
+
+    # my order filed take optional for_fields parametter that to indicate the fields that
+    # the order has to be calculated with respect to
     def __init__(self, for_fields=None, *args, **kwargs):
         self.for_fields = for_fields
         super(OrderField, self).__init__(*args, **kwargs)
-    
+
+    def get_scope(self, model_instance):
+        # i use the attname (course_id) so the related object is never fetched
+        scope = {}
+        for name in self.for_fields or []:
+            attname = self.model._meta.get_field(name).attname
+            scope[attname] = getattr(model_instance, attname)
+        return scope
+
+    def get_counter_key(self, scope):
+        return 'order:{}:{}'.format(
+            self.model._meta.label_lower,
+            ','.join('{}={}'.format(name, value) for name, value in sorted(scope.items()))
+        )
+
+    def get_last_order(self, scope):
+        # the highest order in the database, -1 when there is no object yet
+        last = self.model._default_manager.filter(**scope).aggregate(last=Max(self.attname))['last']
+        return -1 if last is None else last
+
+    def get_scopes(self, queryset):
+        # the scopes of the rows of a queryset, one query
+        attnames = [self.model._meta.get_field(name).attname for name in self.for_fields or []]
+        if not attnames:
+            return [{}]
+        rows = queryset.order_by().values_list(*attnames).distinct()
+        return [dict(zip(attnames, values)) for values in rows]
+
+    def allocate(self, scope, count=1):
+        """Reserve `count` consecutive orders in the given scope and return the first one."""
+        key = self.get_counter_key(scope)
+        try:
+            return cache.incr(key, count) - count + 1
+        except ValueError:
+            pass
+        # no counter yet (or not anymore), it starts from the database
+        last = self.get_last_order(scope)
+        cache.add(key, last, ORDER_COUNTER_TIMEOUT)
+        try:
+            reserved = cache.incr(key, count)
+        except ValueError:
+            # the cache is not available, the database alone
+            return last + 1
+        return reserved - count + 1
+
+    def forget(self, scope, using=None):
+        """Drop the counter of a scope whose orders were written without it."""
+        key = self.get_counter_key(scope)
+        cache.delete(key)
+        # the others may have started it again before the commit, from the old orders
+        transaction.on_commit(lambda: cache.delete(key), using=using)
+
+    def written(self, scope, value, using=None):
+        # an order given by hand, the counter must not hand it out later
+        counter = cache.get(self.get_counter_key(scope))
+        if counter is None or value > counter:
+            self.forget(scope, using)
+
+    def assign(self, objs):
+        """Give an order to every object without one, with one counter update per scope (used by bulk_create)."""
+        scopes, written = {}, {}
+        for obj in objs:
+            scope = tuple(sorted(self.get_scope(obj).items()))
+            value = getattr(obj, self.attname)
+            if value is None:
+                scopes.setdefault(scope, []).append(obj)
+            else:
+                written[scope] = max(value, written.get(scope, value))
+        for scope, value in written.items():
+            self.written(dict(scope), value)
+        for scope, group in scopes.items():
+            first = self.allocate(dict(scope), len(group))
+            for offset, obj in enumerate(group):
+                setattr(obj, self.attname, first + offset)
+
     def pre_save(self, model_instance, add):
-        # before saveing we check if a value already exist 
+        # before saveing we check if a value already exist
         if getattr(model_instance, self.attname) is None:
-            # no current value
-            try:
-                # i build a query set to retrive object for the fields model 
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    # filter by object with the same field value for the fields in  "for_fields"
-                    query = {field: getattr(model_instance, field) for field in self.for_fields}
-                    # i retrive the object with highest order with last item from the database
-                    qs = qs.filter(**query)
-                # get the order from the last item
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1 
-            except ObjectDoesNotExist:
-                # if no object is found we assume that this object is the last one and assigned the order 'o'
-                # if found we assigned '1' to the highest order found.
-                value = 0 
+            # no current value, so we take the next order of the scope
+            value = self.allocate(self.get_scope(model_instance))
             # we assigned the calculated order
             setattr(model_instance, self.attname, value)
             return value
         else:
-            # if modeld instance has a value to the current field we don't do anything
-            return super(OrderField, self).pre_save(model_instance, add)
\ No newline at end of file
+            # if modeld instance has a value to the current field we keep it, the counter
+            # of the scope is dropped if it's behind
+            self.written(self.get_scope(model_instance), getattr(model_instance, self.attname),
+                         model_instance._state.db)
+            return super(OrderField, self).pre_save(model_instance, add)
+
+
+class OrderedQuerySet(models.QuerySet):
+    """QuerySet whose bulk_create() hands out the orders of OrderField in blocks.
+
+    update() drops the order counters of the scopes it writes the orders of (bulk_reorder).
+    """
+
+    def order_fields(self):
+        return [field for field in self.model._meta.concrete_fields if isinstance(field, OrderField)]
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for field in self.order_fields():
+            field.assign(objs)
+        return super(OrderedQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        scopes = [(field, field.get_scopes(self)) for field in self.order_fields()
+                  if field.name in kwargs or field.attname in kwargs]
+        rows = super(OrderedQuerySet, self).update(**kwargs)
+        for field, field_scopes in scopes:
+            for scope in field_scopes:
+                field.forget(scope, self.db)
+        return rows
+
+
+class CounterFieldsMixin(object):
+    """Model mixin, save() never writes the `counter_fields` of an existing object.
+
+    the counters are changed in the database with F() updates (see courses/counters.py),
+    the values in memory are usually old and saving them would undo the other updates.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        return super(CounterFieldsMixin, self).save(*args, **kwargs)
@@ -0,0 +1,136 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from courses import cache as catalog_cache
+from courses.benchmark import seed, endpoints, rolled_back
+from courses.querybudget import query_shape
+
+# query plan audit of the main pages and api endpoints:
+    # seeds a dataset (rolled back at the end), requests every endpoint once with an empty cache,
+    # records the queries and runs EXPLAIN QUERY PLAN on each of them
+    # a query which filters (WHERE) or joins a table and still reads the whole table
+    # (SCAN <table> without an index) is flagged, so is a sort in a temporary b-tree
+    # the queries without WHERE which list a whole table (the catalog snapshots) are expected to scan
+# python manage.py audit_query_plans --fail  (exits with an error when a scan is flagged, for the CI)
+# EXPLAIN QUERY PLAN is SQLite's, on another database the command refuses to run
+
+# SQLite >= 3.36 writes 'SCAN courses_course', the older versions 'SCAN TABLE courses_course'
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?')
+INDEXED = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'VIRTUAL TABLE')
+TEMP_SORT = 'USE TEMP B-TREE'
+WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class StatementRecorder(object):
+    """execute_wrapper which keeps the sql and the parameters of every statement."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(STATEMENTS):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    """Return the detail column of the query plan rows of `sql`."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        # (id, parent, notused, detail)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(sql, plan):
+    """Return the plan rows which read a whole table while the query filters."""
+    if not WHERE.search(sql):
+        return []
+    return [
+        detail for detail in plan
+        if SCAN.match(detail) and not any(marker in detail for marker in INDEXED)
+    ]
+
+
+def temp_sorts(plan):
+    return [detail for detail in plan if detail.startswith(TEMP_SORT)]
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the queries of the main endpoints and flag the full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=10)
+        parser.add_argument('--courses', type=int, default=200)
+        parser.add_argument('--modules', type=int, default=6, help='modules per course')
+        parser.add_argument('--contents', type=int, default=8, help='contents per module')
+        parser.add_argument('--students', type=int, default=50, help='students of every course')
+        parser.add_argument('--sorts', action='store_true', help='also show the sorts in temporary b-trees')
+        parser.add_argument('--fail', action='store_true', help='exit with an error when a scan is flagged')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN needs SQLite, the database is {}'.format(connection.vendor))
+        # an empty cache of its own, or the cached pages would hide their queries
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'audit-query-plans',
+        }}
+        try:
+            with override_settings(CACHES=caches, ALLOWED_HOSTS=['testserver']):
+                catalog_cache.local_cache.clear()
+                catalog_cache.local_generations.clear()
+                with rolled_back():
+                    flagged = self.audit(options)
+        finally:
+            catalog_cache.local_cache.clear()
+            catalog_cache.local_generations.clear()
+
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS('no full table scan'))
+        elif options['fail']:
+            raise CommandError('{} queries scan a whole table'.format(flagged))
+
+    def audit(self, options):
+        dataset = seed(targets=1, **{name: options[name] for name in
+                                     ('subjects', 'courses', 'modules', 'contents', 'students')})
+        flagged = 0
+        seen = set()
+        for name, client, urls in self.endpoints(dataset):
+            recorder = StatementRecorder()
+            with connection.execute_wrapper(recorder):
+                response = client.get(urls[0])
+            if response.status_code != 200:
+                self.stderr.write('{} answered {}'.format(name, response.status_code))
+            for sql, params in recorder.statements:
+                shape = query_shape(sql)
+                if shape in seen:
+                    continue
+                seen.add(shape)
+                plan = explain(sql, params)
+                scans = full_scans(sql, plan)
+                sorts = temp_sorts(plan) if options['sorts'] else []
+                if scans or sorts:
+                    flagged += bool(scans)
+                    self.stdout.write('{}: {}'.format(name, shape))
+                    for detail in plan:
+                        self.stdout.write('    {}'.format(detail))
+        return flagged
+
+    def endpoints(self, dataset):
+        # the endpoints of the benchmark and the other pages of the instructors and the students
+        main = endpoints(dataset, 1)
+        anonymous, instructor, student = main[0][1], main[4][1], main[3][1]
+        course = dataset['courses'][0]
+        return main + [
+            ('manage_course_list', instructor, [reverse('courses:manage_course_list')]),
+            ('course_module_update', instructor, [reverse('courses:course_module_update', args=[course.id])]),
+            ('student_course_list', student, [reverse('students:student_course_list')]),
+            ('search', anonymous, [reverse('courses:search') + '?q=course']),
+            ('api_subject_list', anonymous, ['/api/subjects/']),
+            ('api_course_detail', anonymous, ['/api/courses/{}/'.format(course.id)]),
+        ]
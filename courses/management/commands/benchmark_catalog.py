@@ -0,0 +1,49 @@
+import pickle
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from courses.benchmark import rolled_back, seed
+from courses.catalog import build_subjects_snapshot, build_courses_snapshot, load_subjects, load_courses
+from courses.models import Subject, Course
+
+
+class Command(BaseCommand):
+    help = 'Compare the size and unpickle time of the catalog snapshots against pickled querysets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='create this many fake courses first (rolled back at the end)')
+        parser.add_argument('--subjects', type=int, default=20)
+        parser.add_argument('--modules', type=int, default=5, help='modules per fake course')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            if options['seed']:
+                # the catalog only shows the courses and the number of their modules
+                seed(subjects=options['subjects'], courses=options['seed'], modules=options['modules'],
+                     contents=0, students=0, targets=0)
+            self.compare(options['repeat'])
+
+    def compare(self, repeat):
+        # what course_list used to store: the annotated querysets
+        subjects_qs = Subject.objects.annotate(total_courses=Count('courses'))
+        courses_qs = Course.objects.annotate(total_modules=Count('modules'))
+        rows = [
+            ('all_subjects', subjects_qs, build_subjects_snapshot(), load_subjects),
+            ('all_courses', courses_qs, build_courses_snapshot(), load_courses),
+        ]
+        self.stdout.write('{:<14}{:>10}{:>14}{:>14}{:>14}{:>14}'.format(
+            'key', 'rows', 'qs bytes', 'snap bytes', 'qs load ms', 'snap load ms'))
+        for name, qs, snapshot, load in rows:
+            # pickle.dumps evaluates the queryset, the same way cache.set() does it
+            qs_data = pickle.dumps(qs, pickle.HIGHEST_PROTOCOL)
+            snapshot_data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+            qs_time = timeit.timeit(lambda: list(pickle.loads(qs_data)), number=repeat)
+            # the snapshot is also turned into rows, that's what the view does on every hit
+            snapshot_time = timeit.timeit(lambda: load(pickle.loads(snapshot_data)), number=repeat)
+            self.stdout.write('{:<14}{:>10}{:>14}{:>14}{:>14.3f}{:>14.3f}'.format(
+                name, len(snapshot), len(qs_data), len(snapshot_data),
+                qs_time * 1000 / repeat, snapshot_time * 1000 / repeat))
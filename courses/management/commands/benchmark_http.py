@@ -0,0 +1,120 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from courses import cache as catalog_cache
+from courses.backends.standin import MemcachedStandIn
+from courses.benchmark import seed, endpoints, rolled_back
+
+# load benchmark of the main pages and api endpoints:
+    # seeds a dataset (rolled back at the end), starts a memcached stand-in and sends
+    # the requests through the django test client, with the whole middleware stack
+    # every endpoint gets --requests requests spread over a few different objects, the first
+    # request of each object is the cold one (empty cache)
+    # the results go to a json file, so two runs (i.e. two commits) can be compared
+# python manage.py benchmark_http --output before.json
+
+
+def percentile(values, percent):
+    # nearest rank
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries, cache hits/misses and bytes of the main endpoints on a seeded dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=10)
+        parser.add_argument('--courses', type=int, default=200)
+        parser.add_argument('--modules', type=int, default=6, help='modules per course')
+        parser.add_argument('--contents', type=int, default=8, help='contents per module')
+        parser.add_argument('--students', type=int, default=100, help='students of every course')
+        parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+        parser.add_argument('--targets', type=int, default=5, help='different objects per endpoint')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--label', default='', help='i.e. the commit, stored in the results')
+
+    def handle(self, *args, **options):
+        self.node = MemcachedStandIn().start()
+        caches = {'default': {
+            'BACKEND': 'courses.backends.memcached.PooledMemcachedCache',
+            'LOCATION': [self.node.location],
+        }}
+        try:
+            with override_settings(CACHES=caches, ALLOWED_HOSTS=['testserver']):
+                # the in-process tier must not remember anything from another cache
+                catalog_cache.local_cache.clear()
+                catalog_cache.local_generations.clear()
+                with rolled_back():
+                    results = self.run(options)
+        finally:
+            self.node.stop()
+            catalog_cache.local_cache.clear()
+            catalog_cache.local_generations.clear()
+
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        self.report(results['endpoints'])
+        self.stdout.write('results written to {}'.format(options['output']))
+
+    def run(self, options):
+        dataset = seed(**{name: options[name] for name in
+                            ('subjects', 'courses', 'modules', 'contents', 'students', 'targets')})
+        return {
+            'label': options['label'],
+            'created': timezone.now().isoformat(),
+            'dataset': {name: options[name] for name in
+                        ('subjects', 'courses', 'modules', 'contents', 'students')},
+            'endpoints': {
+                name: self.measure(client, urls, options['requests'])
+                for name, client, urls in endpoints(dataset, options['targets'])
+            },
+        }
+
+    def measure(self, client, urls, total):
+        timings, queries, hits, misses, sizes, statuses = [], [], [], [], [], set()
+        cold = []
+        for i in range(total):
+            url = urls[i % len(urls)]
+            before = self.node.stats()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                elapsed = (time.perf_counter() - start) * 1000
+            after = self.node.stats()
+            timings.append(elapsed)
+            if i < len(urls):
+                cold.append(elapsed)
+            queries.append(len(captured))
+            hits.append(after['get_hits'] - before['get_hits'])
+            misses.append(after['get_misses'] - before['get_misses'])
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+        return {
+            'requests': total,
+            'status': sorted(statuses),
+            'cold_ms': round(sum(cold) / len(cold), 3),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'queries_per_request': round(sum(queries) / total, 2),
+            'max_queries': max(queries),
+            'cache_hits_per_request': round(sum(hits) / total, 2),
+            'cache_misses_per_request': round(sum(misses) / total, 2),
+            'bytes_per_request': int(sum(sizes) / total),
+        }
+
+    def report(self, endpoints):
+        self.stdout.write('{:<24}{:>8}{:>10}{:>10}{:>10}{:>10}{:>8}{:>8}{:>10}'.format(
+            'endpoint', 'status', 'cold ms', 'p50 ms', 'p95 ms', 'queries', 'hits', 'misses', 'bytes'))
+        for name, result in endpoints.items():
+            self.stdout.write('{:<24}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8.2f}{:>8.2f}{:>10}'.format(
+                name, ','.join(str(status) for status in result['status']), result['cold_ms'],
+                result['p50_ms'], result['p95_ms'], result['queries_per_request'],
+                result['cache_hits_per_request'], result['cache_misses_per_request'],
+                result['bytes_per_request']))
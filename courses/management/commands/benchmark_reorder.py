@@ -0,0 +1,52 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from courses.benchmark import rolled_back
+from courses.models import Subject, Course, Module
+from courses.ordering import bulk_reorder
+
+
+class Command(BaseCommand):
+    help = 'Compare the old one-update-per-module reorder against bulk_reorder()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8}{:>14}{:>14}{:>14}{:>14}'.format(
+            'modules', 'loop queries', 'loop ms', 'bulk queries', 'bulk ms'))
+        for size in options['sizes']:
+            with rolled_back():
+                self.run(size)
+
+    def run(self, size):
+        owner, _ = User.objects.get_or_create(username='benchmark')
+        subject, _ = Subject.objects.get_or_create(slug='benchmark-subject', defaults={'title': 'Benchmark'})
+        course = Course.objects.create(owner=owner, subject=subject, title='Benchmark',
+                                       slug='benchmark-course', overview='benchmark')
+        Module.objects.bulk_create([
+            Module(course=course, title='Module {}'.format(i), description='description', order=i)
+            for i in range(size)
+        ])
+        ids = list(course.modules.values_list('id', flat=True))
+        # the same payload the drag and drop sends: {id: new order}, here reversed
+        orders = {str(id): size - i - 1 for i, id in enumerate(ids)}
+
+        # what ModuleOrderView used to do
+        with CaptureQueriesContext(connection) as loop_queries:
+            start = time.perf_counter()
+            for id, order in orders.items():
+                Module.objects.filter(id=id, course__owner=owner).update(order=order)
+            loop_time = time.perf_counter() - start
+
+        with CaptureQueriesContext(connection) as bulk_queries:
+            start = time.perf_counter()
+            bulk_reorder(Module.objects.filter(course__owner=owner), orders)
+            bulk_time = time.perf_counter() - start
+
+        self.stdout.write('{:>8}{:>14}{:>14.2f}{:>14}{:>14.2f}'.format(
+            size, len(loop_queries), loop_time * 1000, len(bulk_queries), bulk_time * 1000))
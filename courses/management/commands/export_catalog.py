@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from courses.export import iter_ndjson, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Export subjects, courses, modules and contents as NDJSON (one object per line)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='file to write to, the default is stdout')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lines = iter_ndjson(options['chunk_size'])
+        if not options['output']:
+            # every line already ends with its newline
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from courses.models import Upload
+from courses.uploads import discard
+
+
+class Command(BaseCommand):
+    help = 'Delete the chunked uploads which received nothing for a while, and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='idle for at least this many hours')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        # the complete uploads have no partial file anymore, they are kept as the history of the contents
+        abandoned = Upload.objects.filter(content__isnull=True, updated__lt=since)
+        total = 0
+        for upload in abandoned.iterator():
+            if not upload.complete:
+                discard(upload)
+                total += 1
+        self.stdout.write('{} uploads purged'.format(total))
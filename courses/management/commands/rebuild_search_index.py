@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from courses.search import rebuild, search_available
+
+
+class Command(BaseCommand):
+    help = 'Index every course, module and text content again in the full text search index'
+
+    def handle(self, *args, **options):
+        if not search_available():
+            self.stderr.write('The full text search index needs SQLite (FTS5)')
+            return
+        rebuild()
+        self.stdout.write('search index rebuilt')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from courses.cache import bump, subject_namespace
+from courses.counters import reconcile
+from courses.models import Subject
+
+
+class Command(BaseCommand):
+    help = 'Count the courses, modules, contents and students again and fix the counters which drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the drift')
+
+    def handle(self, *args, **options):
+        fixed = reconcile(dry_run=options['dry_run'])
+        for counter, total in fixed.items():
+            self.stdout.write('{:<24}{:>8} {}'.format(
+                counter, total, 'drifted' if options['dry_run'] else 'fixed'))
+        if any(fixed.values()) and not options['dry_run']:
+            # the catalog snapshots show the counters
+            subject_ids = Subject.objects.values_list('id', flat=True)
+            bump('subjects', 'courses', *[subject_namespace(id) for id in subject_ids])
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-17 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_course_students'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['created', 'id'], name='courses_cou_created_36197f_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+# the full text index of courses/search.py, only on SQLite (FTS5)
+# prefix='2 3' keeps the prefixes of 2 and 3 letters in the index, for the "as you type" queries
+
+CREATE_SQL = '''
+    CREATE VIRTUAL TABLE courses_search USING fts5(
+        title, body, course_id UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+
+FILL_SQL = [
+    '''INSERT INTO courses_search (rowid, title, body, course_id)
+       SELECT id * 4 + 1, title, overview, id FROM courses_course''',
+    '''INSERT INTO courses_search (rowid, title, body, course_id)
+       SELECT id * 4 + 2, title, description, course_id FROM courses_module''',
+    '''INSERT OR REPLACE INTO courses_search (rowid, title, body, course_id)
+       SELECT text.id * 4 + 3, text.title, text.content, module.course_id
+       FROM courses_text AS text
+       JOIN courses_content AS content ON content.object_id = text.id
+       JOIN django_content_type AS type ON type.id = content.content_type_id
+            AND type.app_label = 'courses' AND type.model = 'text'
+       JOIN courses_module AS module ON module.id = content.module_id''',
+]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    for sql in FILL_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE courses_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_course_created_id_index'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
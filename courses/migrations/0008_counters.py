@@ -0,0 +1,54 @@
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(model, related_field, group_field):
+    rows = model.objects.filter(**{related_field: OuterRef('pk')}).order_by()\
+        .values(related_field).annotate(total=Count(group_field)).values('total')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Subject = apps.get_model('courses', 'Subject')
+    Course = apps.get_model('courses', 'Course')
+    Module = apps.get_model('courses', 'Module')
+    Content = apps.get_model('courses', 'Content')
+    Enrollment = Course.students.through
+    Subject.objects.update(course_count=count(Course, 'subject', 'id'))
+    Course.objects.update(
+        module_count=count(Module, 'course', 'id'),
+        content_count=count(Content, 'module__course', 'id'),
+        student_count=count(Enrollment, 'course', 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='course_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Courses'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='module_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Modules'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='content_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Contents'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='student_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Students'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
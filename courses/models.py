@@ -1,19 +1,24 @@
+import uuid
+
 from django.db import models
 from django.utils.translation import gettext as _
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.template.loader import render_to_string
 from django.utils.safestring import mark_safe
 
-from .fields import OrderField
+from .fields import OrderField, OrderedQuerySet, CounterFieldsMixin
+from .rendering import prefetch_rendered
 
 
-class Subject(models.Model):
+class Subject(CounterFieldsMixin, models.Model):
     """Model definition for Subject."""
 
     title = models.CharField(_("title"), max_length=200)
     slug  = models.SlugField(_("slug"), unique=True, max_length=210)
+    # counters kept up to date by courses/counters.py, so the lists don't need a GROUP BY
+    course_count = models.PositiveIntegerField(_("Courses"), default=0, editable=False)
+    counter_fields = ('course_count', )
 
     class Meta:
         """Meta definition for Subject."""
@@ -27,21 +32,30 @@ class Subject(models.Model):
         return self.title
 
 
-class Course(models.Model):
+class Course(CounterFieldsMixin, models.Model):
     """Model definition for Course."""
 
     owner = models.ForeignKey(User, verbose_name=_("Owner"), related_name="courses_created", on_delete=models.CASCADE)
-    subject = models.ForeignKey("courses.Subject", verbose_name=_("Subject"), related_name="courses", on_delete=models.CASCADE)
+    subject = models.ForeignKey("courses.Subject", verbose_name=_("Subject"), related_name="courses", on_delete=models.CASCADE,
+                                db_index=False)
     title   = models.CharField(_("Title"), max_length=200)
     slug    = models.SlugField(_("Slug"), max_length=210)
     overview = models.TextField(_("Overview"))
     created = models.DateTimeField(_("Created"), auto_now_add=True)
     students = models.ManyToManyField(User, verbose_name=_("Students"), related_name="courses_joined", blank=True)
+    # counters kept up to date by courses/counters.py
+    module_count = models.PositiveIntegerField(_("Modules"), default=0, editable=False)
+    content_count = models.PositiveIntegerField(_("Contents"), default=0, editable=False)
+    student_count = models.PositiveIntegerField(_("Students"), default=0, editable=False)
+    counter_fields = ('module_count', 'content_count', 'student_count')
     
     class Meta:
         """Meta definition for Course."""
 
         ordering = ('created', )
+        # the cursor pagination of the api reads the courses in (created, id) order
+        # the courses of a subject are listed by creation date
+        indexes = [models.Index(fields=['created', 'id']), models.Index(fields=['subject', 'created'])]
         verbose_name = 'Course'
         verbose_name_plural = 'Courses'
 
@@ -53,16 +67,23 @@ class Course(models.Model):
 class Module(models.Model):
     """Model definition for Module."""
 
-    course = models.ForeignKey(Course, verbose_name=_("Course"), related_name="modules", on_delete=models.CASCADE)
+    # no index of its own, the (course, order) index below starts with it
+    course = models.ForeignKey(Course, verbose_name=_("Course"), related_name="modules", on_delete=models.CASCADE,
+                               db_index=False)
     title   = models.CharField(_("Title"), max_length=200)
     description = models.TextField(_("Description"))
     order = OrderField(blank=True, for_fields=['course'])
 
+    # bulk_create gives the new modules consecutive orders, see courses/fields.py
+    objects = OrderedQuerySet.as_manager()
+
 
     class Meta:
         """Meta definition for Module."""
         
         ordering = ['order']
+        # the modules of a course are always read in order, and OrderField looks for the last one
+        indexes = [models.Index(fields=['course', 'order'])]
         verbose_name = 'Module'
         verbose_name_plural = 'Modules'
 
@@ -71,24 +92,41 @@ class Module(models.Model):
         return f'{self.order}, {self.title}'
 
 
+def prefetch_items(contents):
+    """Load the items of already fetched contents with one query per content type."""
+    # the GenericForeignKey prefetcher groups the contents by content_type
+    # so 200 contents of 4 types cost 4 queries instead of 200
+    models.prefetch_related_objects(contents, 'item')
+    return contents
+
+
+class ContentQuerySet(OrderedQuerySet):
+    def with_items(self):
+        """Contents with their Text/Video/Image/File items fetched in bulk."""
+        return self.prefetch_related('item')
+
+
 class Content(models.Model):
     """Model definition for Content.
     - the content type and object_id field have column in database table 
     - The item field alow you to set the related object directly 
     - use different model for each type of content
     """
-    module = models.ForeignKey(Module, related_name='contents', on_delete=models.CASCADE)
+    # module and content_type have no index of their own, the indexes in Meta start with them
+    module = models.ForeignKey(Module, related_name='contents', on_delete=models.CASCADE, db_index=False)
     order = OrderField(blank=True, for_fields=['module'])
     content_type = models.ForeignKey(ContentType, verbose_name=_("Content type"),
                                     # model__in lookup is going to filter the query to the content obj
                                     # with the model attribute which is 'text', 'video', 'image' and 'file'
                                     limit_choices_to={'model__in': ('text', 'video', 'image', 'file')},
-                                    on_delete=models.CASCADE
+                                    on_delete=models.CASCADE, db_index=False
     )
     # object_id is for storing the primary key of the related object
     object_id = models.PositiveIntegerField(_("Object Id"))
     item = GenericForeignKey('content_type', 'object_id')
 
+    objects = ContentQuerySet.as_manager()
+
     # to understand better the content type and generic relation you have to see this link
     # https://stackoverflow.com/questions/20895429/how-exactly-do-django-content-types-work
 
@@ -97,6 +135,12 @@ class Content(models.Model):
         """Meta definition for Content."""
 
         ordering = ['order']
+        indexes = [
+            # the contents of a module, in order
+            models.Index(fields=['module', 'order']),
+            # from an item back to its content (the generic relation the other way round)
+            models.Index(fields=['content_type', 'object_id']),
+        ]
         verbose_name = 'Content'
         verbose_name_plural = 'Contents'
 
@@ -123,8 +167,12 @@ class ItemBase(models.Model):
         return self.title
 
     def render(self):
-        # i use self._meta.model_name to build the appropriate template
-        return render_to_string('courses/content/{}.html'.format(self._meta.model_name), {'item': self})
+        # the html is cached per item and `updated` timestamp, see courses/rendering.py
+        html = getattr(self, '_rendered_html', None)
+        if html is None:
+            prefetch_rendered([self])
+            html = self._rendered_html
+        return mark_safe(html)
 
 class Text(ItemBase):
     # that related name with %(class)s which i created is very crucial which means that 
@@ -142,4 +190,40 @@ class Video(ItemBase):
 
 
 class Image(ItemBase):
-    file = models.FileField(_("File"), upload_to='Uploads/courses/Images', max_length=100)
\ No newline at end of file
+    file = models.FileField(_("File"), upload_to='Uploads/courses/Images', max_length=100)
+
+class Upload(models.Model):
+    """A chunked upload of a File or Image content, see courses/uploads.py."""
+
+    MODEL_CHOICES = (('file', 'File'), ('image', 'Image'))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, verbose_name=_("Owner"), related_name='uploads', on_delete=models.CASCADE)
+    module = models.ForeignKey(Module, verbose_name=_("Module"), related_name='uploads', on_delete=models.CASCADE)
+    model_name = models.CharField(_("Content type"), max_length=10, choices=MODEL_CHOICES)
+    title = models.CharField(_("Title"), max_length=255)
+    filename = models.CharField(_("File name"), max_length=255)
+    size = models.PositiveBigIntegerField(_("Size"))
+    # the bytes received so far, the next chunk starts there
+    offset = models.PositiveBigIntegerField(_("Offset"), default=0)
+    # the sha256 (hex) of every chunk received, one after the other
+    chunk_digests = models.TextField(_("Chunk digests"), blank=True, default='', editable=False)
+    # the content created when the last chunk arrived
+    content = models.OneToOneField(Content, verbose_name=_("Content"), related_name='upload', null=True,
+                                   blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(_("Created"), auto_now_add=True)
+    updated = models.DateTimeField(_("Updated"), auto_now=True)
+
+    class Meta:
+        """Meta definition for Upload."""
+
+        verbose_name = 'Upload'
+        verbose_name_plural = 'Uploads'
+
+    def __str__(self):
+        """Unicode representation of Upload."""
+        return self.filename
+
+    @property
+    def complete(self):
+        return self.offset == self.size
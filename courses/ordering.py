@@ -0,0 +1,48 @@
+from django.db import connections, transaction
+from django.db.models import Case, When, Value, PositiveIntegerField
+
+
+def _batches(ids, size):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def bulk_reorder(queryset, orders):
+    """Set the `order` of many rows at once.
+
+    `queryset` must only contain the rows the user is allowed to reorder
+    (i.e. Module.objects.filter(course__owner=user)) and `orders` maps ids to
+    their new order. Everything runs inside one transaction: one query checks
+    the ids and one CASE update writes the orders. Returns the ids which were
+    updated and the ids which were rejected (unknown, not owned or invalid).
+    """
+    parsed, rejected = {}, []
+    for id, order in orders.items():
+        try:
+            id, order = int(id), int(order)
+        except (TypeError, ValueError):
+            rejected.append(id)
+            continue
+        if order < 0:
+            rejected.append(id)
+            continue
+        parsed[id] = order
+
+    # every row of the CASE uses two parameters and the IN one more, so on databases
+    # with a parameter limit (sqlite) a very long list is split in a few statements
+    max_params = connections[queryset.db].features.max_query_params
+    batch_size = max_params // 3 if max_params else len(parsed) or 1
+
+    updated = []
+    with transaction.atomic(using=queryset.db):
+        for batch in _batches(parsed, batch_size):
+            updated.extend(queryset.filter(id__in=batch).values_list('id', flat=True))
+        owned = set(updated)
+        rejected.extend(id for id in parsed if id not in owned)
+        for batch in _batches(updated, batch_size):
+            queryset.model._default_manager.filter(id__in=batch).update(order=Case(
+                *[When(id=id, then=Value(parsed[id])) for id in batch],
+                output_field=PositiveIntegerField()
+            ))
+    return sorted(updated), rejected
@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# query budgets:
+    # every url name can have a maximum number of queries in settings.QUERY_BUDGETS,
+    # i.e. {'course_list': 3, 'courses:course_detail': 4}
+    # QueryBudgetMiddleware records the queries of a sample of the requests
+    # (QUERY_BUDGET_SAMPLE_RATE) and logs a warning when a view goes over its budget,
+    # with QUERY_BUDGET_STRICT = True it raises QueryBudgetExceeded instead
+    # the tests use QueryBudgetTestMixin.assertQueryBudget(), which fails the test
+# the report also shows the duplicated query shapes, that's how an N+1 looks like
+# under ASGI the middleware is async too (or django would run the async views in a thread)
+# the queries of an async view run in another thread, so they are recorded by a wrapper
+# on the connections of that thread which finds the report of its request in a context variable
+
+logger = logging.getLogger('courses.queries')
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    """The sql without its values, two queries with the same shape only differ by their parameters."""
+    sql = SPACES.sub(' ', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    return NUMBER.sub('?', sql)
+
+
+class QueryReport(object):
+    """Records the queries executed through the database connections (see record_queries())."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        # in ms
+        return sum(duration for sql, duration in self.queries) * 1000
+
+    def duplicates(self):
+        """Return [(shape, count)] of the query shapes executed more than once, most frequent first."""
+        shapes = Counter(query_shape(sql) for sql, duration in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count > 1]
+
+    def describe(self, name, budget):
+        lines = ['{} ran {} queries in {:.2f}ms, its budget is {}'.format(name, self.count, self.time, budget)]
+        for shape, count in self.duplicates():
+            lines.append('  {} x {}'.format(count, shape))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def record_queries():
+    """Record the queries of every database connection of this thread."""
+    report = QueryReport()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(report))
+        yield report
+
+
+_current_report = contextvars.ContextVar('query_report', default=None)
+
+
+def _record_current(execute, sql, params, many, context):
+    report = _current_report.get()
+    if report is None:
+        return execute(sql, params, many, context)
+    return report(execute, sql, params, many, context)
+
+
+def _install_current_recorder():
+    # once per connection, the database thread of the async views serves every request
+    for connection in connections.all():
+        if _record_current not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_record_current)
+
+
+def get_budget(name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(name)
+
+
+def over_budget(name, report):
+    budget = get_budget(name)
+    return budget is not None and report.count > budget
+
+
+def sampled():
+    return random.random() < getattr(settings, 'QUERY_BUDGET_SAMPLE_RATE', 0.01)
+
+
+class QueryBudgetMiddleware(object):
+    """Check the sampled requests against the query budget of their url name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # like django's MiddlewareMixin, so the handler awaits __call__
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        with record_queries() as report:
+            response = self.get_response(request)
+        self.check(request, report)
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        await sync_to_async(_install_current_recorder)()
+        report = QueryReport()
+        token = _current_report.set(report)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_report.reset(token)
+        self.check(request, report)
+        return response
+
+    def check(self, request, report):
+        # there is no resolver_match when the response comes from the page cache
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and over_budget(match.view_name, report):
+            message = report.describe(match.view_name, get_budget(match.view_name))
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+
+class QueryBudgetTestMixin(object):
+    """TestCase mixin, assertQueryBudget() fails when a page runs more queries than its budget."""
+
+    def assertQueryBudget(self, url, client=None, status=200):
+        client = client or self.client
+        with record_queries() as report:
+            response = client.get(url)
+        self.assertEqual(response.status_code, status)
+        name = response.resolver_match.view_name
+        budget = get_budget(name)
+        if budget is None:
+            self.fail('{} has no query budget in settings.QUERY_BUDGETS'.format(name))
+        if report.count > budget:
+            self.fail(report.describe(name, budget))
+        return response
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .cache import record_dependencies, object_namespace
+
+# rendered html of the content items:
+# the key contains the `updated` timestamp of the item, so saving an item
+# (auto_now changes `updated`) makes the old html unreachable by itself.
+# deleting an item removes its html, see courses/signals.py
+
+ITEM_HTML_TIMEOUT = getattr(settings, 'ITEM_HTML_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def item_html_key(item):
+    return 'item_html:{}:{}:{}'.format(
+        item._meta.model_name, item.pk, item.updated.timestamp() if item.updated else ''
+    )
+
+
+def render_item(item):
+    # i use item._meta.model_name to build the appropriate template
+    return render_to_string('courses/content/{}.html'.format(item._meta.model_name), {'item': item})
+
+
+def prefetch_rendered(items):
+    """Fill the rendered html of many items with one get_many (and one set_many for the misses)."""
+    items = [item for item in items if item is not None]
+    # the fragments which show this html must be purged when one of the items changes
+    record_dependencies(*[object_namespace(item) for item in items])
+    keys = {item_html_key(item): item for item in items}
+    found = cache.get_many(keys.keys())
+    missing = {}
+    for key, item in keys.items():
+        html = found.get(key)
+        if html is None:
+            html = missing[key] = str(render_item(item))
+        item._rendered_html = html
+    if missing:
+        cache.set_many(missing, ITEM_HTML_TIMEOUT)
+    return items
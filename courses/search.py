@@ -0,0 +1,176 @@
+import re
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# full text search:
+    # an inverted index in a SQLite FTS5 table (courses_search, created by migration 0007)
+    # with the title and the text of every course (overview), module (description) and
+    # text content, kept up to date by the signals (courses/signals.py)
+    # the rowid of a document is object_id * 4 + kind, so a document is replaced or removed
+    # by its rowid without scanning the index
+    # the results are ranked with bm25 (title matches count more, the rank of FTS5 with its
+    # weights given in the query) and come with a snippet, made here and not with snippet()
+    # of FTS5, which reads the whole doclist of every word again
+    # the text contents are only found by the owner and the students of their course,
+    # the anonymous users and everybody else only find the courses and the modules
+# on another database than SQLite there is no index and search() finds nothing
+
+COURSE, MODULE, TEXT = 1, 2, 3
+KINDS = {COURSE: 'course', MODULE: 'module', TEXT: 'text'}
+
+MAX_TERMS = 10
+TERM = re.compile(r'\w+', re.UNICODE)
+SNIPPET_WORDS = 24
+RANK = 'bm25(5.0, 1.0)'
+
+# every match is ranked before the limit, ORDER BY rank LIMIT n keeps only the best n
+# in memory while FTS5 goes through the matches
+# a user id of NULL (anonymous) matches no owner and no student
+SEARCH_SQL = '''
+    SELECT s.rowid, s.title, s.body, course.id, course.slug, course.title, s.rank
+    FROM courses_search AS s
+    JOIN courses_course AS course ON course.id = s.course_id
+    WHERE courses_search MATCH %s AND s.rank MATCH %s
+      AND (s.rowid %% 4 != 3 OR course.owner_id = %s OR EXISTS (
+          SELECT 1 FROM courses_course_students AS student
+          WHERE student.course_id = course.id AND student.user_id = %s
+      ))
+    ORDER BY s.rank
+    LIMIT %s
+'''
+
+# the text contents get their course through their module (Content is a generic relation)
+REBUILD_SQL = [
+    'DELETE FROM courses_search',
+    '''INSERT INTO courses_search (rowid, title, body, course_id)
+       SELECT id * 4 + 1, title, overview, id FROM courses_course''',
+    '''INSERT INTO courses_search (rowid, title, body, course_id)
+       SELECT id * 4 + 2, title, description, course_id FROM courses_module''',
+    '''INSERT OR REPLACE INTO courses_search (rowid, title, body, course_id)
+       SELECT text.id * 4 + 3, text.title, text.content, module.course_id
+       FROM courses_text AS text
+       JOIN courses_content AS content ON content.object_id = text.id
+       JOIN django_content_type AS type ON type.id = content.content_type_id
+            AND type.app_label = 'courses' AND type.model = 'text'
+       JOIN courses_module AS module ON module.id = content.module_id''',
+]
+
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, object_id):
+    return object_id * 4 + kind
+
+
+def index(kind, object_id, title, body, course_id):
+    """Add or replace the document of an object."""
+    if not search_available():
+        return
+    rowid = _rowid(kind, object_id)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # fts5 tables have no unique constraint to replace on, so delete first
+        cursor.execute('DELETE FROM courses_search WHERE rowid = %s', [rowid])
+        cursor.execute(
+            'INSERT INTO courses_search (rowid, title, body, course_id) VALUES (%s, %s, %s, %s)',
+            [rowid, title, body, course_id]
+        )
+
+
+def unindex(kind, object_id):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM courses_search WHERE rowid = %s', [_rowid(kind, object_id)])
+
+
+def index_course(course):
+    index(COURSE, course.pk, course.title, course.overview, course.pk)
+
+
+def index_module(module):
+    index(MODULE, module.pk, module.title, module.description, module.course_id)
+
+
+def index_text(text, course_id):
+    index(TEXT, text.pk, text.title, text.content, course_id)
+
+
+def rebuild():
+    """Index every course, module and text content again."""
+    if not search_available():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+        cursor.execute("INSERT INTO courses_search (courses_search) VALUES ('optimize')")
+
+
+def get_terms(text):
+    return TERM.findall(text)[:MAX_TERMS]
+
+
+def build_query(terms):
+    """Turn the words the user typed into an FTS5 query: every word must match, the last one as a prefix."""
+    # quoted, so the words are never read as FTS5 operators (AND, NEAR, column:...)
+    quoted = ['"{}"'.format(term) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _stems(terms):
+    # the index stems the words (porter), so "running" matches "run", a shorter prefix
+    # of every word is close enough to find them in the text again
+    return tuple(term.lower()[:max(len(term) - 2, 3)] for term in terms)
+
+
+def highlight(text, terms, size=None):
+    """Escape `text` and wrap the words matching `terms` in <mark>, around the first match
+    and cut to `size` words when a size is given."""
+    stems = _stems(terms)
+    words = list(TERM.finditer(text))
+    matches = [i for i, word in enumerate(words) if word.group().lower().startswith(stems)]
+    first, last = 0, len(words)
+    if size is not None and len(words) > size:
+        first = max(min(matches[0] if matches else 0, len(words) - size) - size // 4, 0)
+        last = first + size
+    begin = words[first].start() if first else 0
+    end = words[last - 1].end() if last < len(words) else len(text)
+    parts = ['…'] if begin else []
+    position = begin
+    for i in matches:
+        if first <= i < last:
+            word = words[i]
+            parts.append(escape(text[position:word.start()]))
+            parts.append('<mark>{}</mark>'.format(escape(word.group())))
+            position = word.end()
+    parts.append(escape(text[position:end]))
+    if end < len(text):
+        parts.append('…')
+    return mark_safe(''.join(parts))
+
+
+def search(text, limit=20, user=None):
+    """Return the best `limit` documents matching `text` which `user` may read, as dicts."""
+    terms = get_terms(text)
+    if not terms or not search_available():
+        return []
+    query = build_query(terms)
+    user_id = user.pk if user is not None and user.is_authenticated else None
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [query, RANK, user_id, user_id, limit])
+        rows = cursor.fetchall()
+    return [{
+        'kind': KINDS[rowid % 4],
+        'id': rowid // 4,
+        'title': highlight(title, terms),
+        'snippet': highlight(body, terms, SNIPPET_WORDS),
+        'course_id': course_id,
+        'course_slug': course_slug,
+        'course_title': course_title,
+        # bm25() is negative, the lower the better
+        'score': round(-score, 4),
+    } for rowid, title, body, course_id, course_slug, course_title, score in rows]
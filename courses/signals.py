@@ -0,0 +1,195 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+from .cache import bump, subject_namespace, course_namespace, module_namespace, object_namespace
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+from .rendering import item_html_key
+from . import search
+from .counters import adjust, adjust_course_of_module
+
+# catalog namespaces used by course_list:
+    # 'subjects' --> all_subjects (subject title, slug and number of courses)
+    # 'courses' --> all_courses (course, subject and number of modules)
+    # 'subject_{id}' --> subject_{id}_courses (same as 'courses' but only for one subject)
+
+
+# counters (see courses/counters.py)
+# connected before the cache receivers below, so a page rebuilt right after the bump
+# already sees the new counters
+
+@receiver(post_save, sender=Course)
+def count_course(sender, instance, created, **kwargs):
+    if created:
+        adjust(Subject, [instance.subject_id], 'course_count', 1)
+        return
+    old_subject_id = getattr(instance, '_old_subject_id', None)
+    if old_subject_id and old_subject_id != instance.subject_id:
+        adjust(Subject, [old_subject_id], 'course_count', -1)
+        adjust(Subject, [instance.subject_id], 'course_count', 1)
+
+
+@receiver(post_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    adjust(Subject, [instance.subject_id], 'course_count', -1)
+
+
+@receiver(post_save, sender=Module)
+def count_module(sender, instance, created, **kwargs):
+    if created:
+        adjust(Course, [instance.course_id], 'module_count', 1)
+
+
+@receiver(post_delete, sender=Module)
+def uncount_module(sender, instance, **kwargs):
+    adjust(Course, [instance.course_id], 'module_count', -1)
+
+
+@receiver(post_save, sender=Content)
+def count_content(sender, instance, created, **kwargs):
+    if created:
+        adjust_course_of_module(instance.module_id, 'content_count', 1)
+
+
+@receiver(post_delete, sender=Content)
+def uncount_content(sender, instance, **kwargs):
+    # when a whole module (or course) is deleted its contents go first, the module is still there
+    adjust_course_of_module(instance.module_id, 'content_count', -1)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def subject_changed(sender, instance, **kwargs):
+    # the course list shows the subject title and slug of each course
+    bump('subjects', 'courses', subject_namespace(instance.pk))
+
+
+@receiver(pre_save, sender=Course)
+def course_pre_save(sender, instance, **kwargs):
+    # remember the old subject, if the course moves to another subject both lists change
+    instance._old_subject_id = None
+    if instance.pk:
+        instance._old_subject_id = Course.objects.filter(pk=instance.pk)\
+            .values_list('subject_id', flat=True).first()
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    namespaces = ['subjects', 'courses', subject_namespace(instance.subject_id),
+                  course_namespace(instance.pk)]
+    old_subject_id = getattr(instance, '_old_subject_id', None)
+    if old_subject_id and old_subject_id != instance.subject_id:
+        namespaces.append(subject_namespace(old_subject_id))
+    bump(*namespaces)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, instance, created=True, **kwargs):
+    # the cached fragments of this module (see the {% cachedeps %} tag) and the
+    # cached pages of its course, which list the title and order of every module
+    bump(module_namespace(instance.pk), course_namespace(instance.course_id))
+    # the catalog only shows the number of modules, so editing a module doesn't change it
+    # (post_delete doesn't send `created`, so a delete always bumps)
+    if not created:
+        return
+    subject_id = Course.objects.filter(pk=instance.course_id)\
+        .values_list('subject_id', flat=True).first()
+    namespaces = ['courses']
+    if subject_id:
+        namespaces.append(subject_namespace(subject_id))
+    bump(*namespaces)
+
+
+@receiver(post_save, sender=User)
+def owner_changed(sender, instance, update_fields=None, **kwargs):
+    # the catalog snapshots keep the instructor name of every course
+    if update_fields and not {'first_name', 'last_name'} & set(update_fields):
+        # i.e. login only updates last_login
+        return
+    subject_ids = set(instance.courses_created.values_list('subject_id', flat=True))
+    if subject_ids:
+        bump('courses', *[subject_namespace(id) for id in subject_ids])
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def content_changed(sender, instance, **kwargs):
+    bump(module_namespace(instance.module_id))
+
+
+@receiver(post_save, sender=Text)
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=File)
+def item_saved(sender, instance, **kwargs):
+    bump(object_namespace(instance))
+
+
+@receiver(post_delete, sender=Text)
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=File)
+def item_deleted(sender, instance, **kwargs):
+    # a saved item gets a new `updated` (so a new key), a deleted one has to be removed
+    cache.delete(item_html_key(instance))
+    bump(object_namespace(instance))
+
+
+# full text search index (see courses/search.py)
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    search.index_course(instance)
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    search.unindex(search.COURSE, instance.pk)
+
+
+@receiver(post_save, sender=Module)
+def index_module(sender, instance, **kwargs):
+    search.index_module(instance)
+
+
+@receiver(post_delete, sender=Module)
+def unindex_module(sender, instance, **kwargs):
+    search.unindex(search.MODULE, instance.pk)
+
+
+@receiver(post_save, sender=Content)
+def index_content(sender, instance, created, **kwargs):
+    # a text is only searchable once it belongs to a module (that's how we know its course)
+    # get_for_id() is cached, instance.content_type would be a query
+    if created and ContentType.objects.get_for_id(instance.content_type_id).model == 'text':
+        course_id = Module.objects.filter(pk=instance.module_id).values_list('course_id', flat=True).first()
+        search.index_text(instance.item, course_id)
+
+
+@receiver(post_delete, sender=Content)
+def unindex_content(sender, instance, **kwargs):
+    if ContentType.objects.get_for_id(instance.content_type_id).model == 'text':
+        search.unindex(search.TEXT, instance.object_id)
+
+
+@receiver(post_save, sender=Text)
+def index_text(sender, instance, created, **kwargs):
+    if created:
+        # not in a module yet, see index_content()
+        return
+    course_id = Content.objects.filter(
+        content_type=ContentType.objects.get_for_model(Text), object_id=instance.pk
+    ).values_list('module__course_id', flat=True).first()
+    if course_id:
+        search.index_text(instance, course_id)
+
+
+@receiver(post_delete, sender=Text)
+def unindex_text(sender, instance, **kwargs):
+    search.unindex(search.TEXT, instance.pk)
+
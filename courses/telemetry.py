@@ -0,0 +1,180 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from pymemcache import serde
+
+# cache telemetry per namespace:
+    # the cache backend (courses.backends.memcached) records the hits, misses and latency of
+    # every read and the size of every value it stores or reads, grouped by the namespace of
+    # the key, i.e. 'subject_*_courses', 'cache_page', 'item_html', 'fragment:module_contents'
+    # every process keeps its numbers in memory and adds them to shared counters in the cache
+    # every TELEMETRY_FLUSH_INTERVAL seconds, so the dashboard shows the totals of all the processes
+# the dashboard is in the admin (/admin/cache/) and the same data is at /api/cache/telemetry/
+
+FLUSH_INTERVAL = getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 10)
+# memcached refuses the items bigger than 1MB (its default item_size_max)
+ITEM_SIZE_LIMIT = getattr(settings, 'TELEMETRY_ITEM_SIZE_LIMIT', 1024 * 1024)
+
+COUNTERS = ('hits', 'misses', 'sets', 'set_bytes', 'get_bytes', 'reads', 'read_us')
+NAMESPACES_KEY = 'telemetry:namespaces'
+COUNTER_KEY = 'telemetry:{}:{}'
+MAX_BYTES_KEY = 'telemetry:{}:max_bytes'
+
+DIGITS = re.compile(r'\d+')
+# the keys which wrap another name keep it: fragment:module_contents, lock:all_courses
+WRAPPER_PREFIXES = ('fragment', 'lock', 'stale')
+# the keys django builds itself (cache_page, {% cache %})
+DJANGO_PREFIXES = (
+    ('views.decorators.cache.cache_page.', 'cache_page'),
+    ('views.decorators.cache.cache_header.', 'cache_header'),
+)
+
+
+def namespace_of(key):
+    """Group a cache key with the other keys of the same kind (the ids become *)."""
+    if isinstance(key, bytes):
+        key = key.decode()
+    for prefix, namespace in DJANGO_PREFIXES:
+        if key.startswith(prefix):
+            return namespace
+    if key.startswith('template.cache.'):
+        # template.cache.<fragment name>.<md5 of the vary_on>
+        return key.rsplit('.', 1)[0]
+    segments = key.split(':', 2)
+    if segments[0] in WRAPPER_PREFIXES:
+        return DIGITS.sub('*', ':'.join(segments[:2]))
+    return DIGITS.sub('*', segments[0])
+
+
+def _user_key(made_key):
+    # the backend stores '<KEY_PREFIX>:<version>:<key>'
+    if isinstance(made_key, bytes):
+        made_key = made_key.decode()
+    return made_key.split(':', 2)[-1]
+
+
+class Telemetry(object):
+    """The numbers of this process which are not in the shared counters yet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._max_bytes = {}
+        self._flushing = threading.local()
+        self._last_flush = time.monotonic()
+
+    def _add(self, namespace, **values):
+        if namespace.startswith('telemetry'):
+            return
+        with self._lock:
+            stats = self._stats.setdefault(namespace, dict.fromkeys(COUNTERS, 0))
+            for name, value in values.items():
+                stats[name] += value
+            size = values.get('set_bytes') or values.get('get_bytes')
+            if size and size > self._max_bytes.get(namespace, 0):
+                self._max_bytes[namespace] = size
+
+    def record_reads(self, keys, found, duration):
+        """Record a get/get_many of `keys` which found the keys in `found` and took `duration` seconds."""
+        namespaces = {}
+        for key in keys:
+            counts = namespaces.setdefault(namespace_of(key), [0, 0])
+            counts[0 if key in found else 1] += 1
+        # the time of a get_many is shared between its namespaces
+        read_us = int(duration * 1000000 / max(len(namespaces), 1))
+        for namespace, (hits, misses) in namespaces.items():
+            self._add(namespace, hits=hits, misses=misses, reads=1, read_us=read_us)
+        self.maybe_flush()
+
+    def record_set(self, made_key, size):
+        self._add(namespace_of(_user_key(made_key)), sets=1, set_bytes=size)
+
+    def record_get(self, made_key, size):
+        self._add(namespace_of(_user_key(made_key)), get_bytes=size)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Add the numbers of this process to the shared counters."""
+        # the flush itself goes through the cache, it must not record (or flush) again
+        if getattr(self._flushing, 'active', False):
+            return
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            max_bytes, self._max_bytes = self._max_bytes, {}
+            self._last_flush = time.monotonic()
+        if not stats:
+            return
+        self._flushing.active = True
+        try:
+            namespaces = cache.get(NAMESPACES_KEY) or frozenset()
+            if not namespaces.issuperset(stats):
+                cache.set(NAMESPACES_KEY, namespaces | frozenset(stats), None)
+            for namespace, values in stats.items():
+                for name, value in values.items():
+                    if value:
+                        key = COUNTER_KEY.format(namespace, name)
+                        try:
+                            cache.incr(key, value)
+                        except ValueError:
+                            # the first flush of this counter, unless another process just made it
+                            if not cache.add(key, value, None):
+                                try:
+                                    cache.incr(key, value)
+                                except ValueError:
+                                    pass
+            shared_max = cache.get_many([MAX_BYTES_KEY.format(namespace) for namespace in max_bytes])
+            cache.set_many({
+                MAX_BYTES_KEY.format(namespace): size for namespace, size in max_bytes.items()
+                if size > shared_max.get(MAX_BYTES_KEY.format(namespace), 0)
+            }, None)
+        finally:
+            self._flushing.active = False
+
+
+telemetry = Telemetry()
+
+
+class TelemetrySerde(object):
+    """pickle serde of pymemcache which also records the size of the values."""
+
+    def serialize(self, key, value):
+        data, flags = serde.pickle_serde.serialize(key, value)
+        telemetry.record_set(key, len(data))
+        return data, flags
+
+    def deserialize(self, key, value, flags):
+        telemetry.record_get(key, len(value))
+        return serde.pickle_serde.deserialize(key, value, flags)
+
+
+# one instance for every client, the backend shares its clients by their options
+telemetry_serde = TelemetrySerde()
+
+
+def collect():
+    """Return the shared numbers of every namespace, the busiest namespaces first."""
+    telemetry.flush()
+    namespaces = sorted(cache.get(NAMESPACES_KEY) or ())
+    keys = [COUNTER_KEY.format(namespace, name) for namespace in namespaces for name in COUNTERS]
+    keys += [MAX_BYTES_KEY.format(namespace) for namespace in namespaces]
+    values = cache.get_many(keys)
+    rows = []
+    for namespace in namespaces:
+        row = {name: values.get(COUNTER_KEY.format(namespace, name), 0) for name in COUNTERS}
+        row['namespace'] = namespace
+        row['max_bytes'] = values.get(MAX_BYTES_KEY.format(namespace), 0)
+        lookups = row['hits'] + row['misses']
+        row['hit_rate'] = round(row['hits'] / lookups, 4) if lookups else None
+        row['avg_set_bytes'] = int(row['set_bytes'] / row['sets']) if row['sets'] else 0
+        row['avg_read_ms'] = round(row['read_us'] / row['reads'] / 1000, 3) if row['reads'] else 0
+        # the payloads which are getting close to what memcached accepts
+        row['max_item_ratio'] = round(row['max_bytes'] / ITEM_SIZE_LIMIT, 4)
+        rows.append(row)
+    rows.sort(key=lambda row: row['hits'] + row['misses'] + row['sets'], reverse=True)
+    return rows
@@ -1,4 +1,11 @@
 from django import template 
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from ..cache import get_or_build_tracked, record_dependencies, object_namespace, module_namespace
+from ..models import prefetch_items
+from ..rendering import prefetch_rendered
+from .. import thumbnails
 
 register = template.Library()
 
@@ -8,4 +15,68 @@ def model_name(obj):
         return obj._meta.model_name 
     except AttributeError:
         return None
-        
\ No newline at end of file
+
+
+@register.filter
+def rendered(contents):
+    """Contents with their items fetched and rendered in bulk: {% for content in contents|rendered %}"""
+    contents = prefetch_items(list(contents))
+    # adding, deleting or reordering contents bumps their module
+    record_dependencies(*{module_namespace(content.module_id) for content in contents})
+    prefetch_rendered(content.item for content in contents)
+    return contents
+
+
+# {% responsive_image item %} shows an Image content with the srcset of its variants (see
+# courses/thumbnails.py), the browser picks the width and the format it needs
+@register.simple_tag
+def responsive_image(item, sizes='100vw'):
+    sources = thumbnails.sources(item)
+    if sources is None:
+        return format_html('<img src="{}" alt="">', item.file.url)
+    # the jpeg variants for the browsers which know <picture> but not webp, the original for the others
+    fallback = dict(sources).get('image/jpeg', sources[-1][1])
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="" loading="lazy"></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                         ((mime, srcset, sizes) for mime, srcset in sources)),
+        item.file.url, fallback, sizes,
+    )
+
+
+# {% cachedeps timeout fragment_name obj1 obj2 ... %} ... {% endcachedeps %}
+# works like the {% cache %} tag but:
+    # the key is built from the model and primary key of the given objects (not from str(obj))
+    # the objects are dependencies of the fragment, just like everything recorded
+    # while the fragment is rendered (i.e. the items shown by |rendered)
+    # the fragment is purged as soon as one of its dependencies changes
+class CacheDepsNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, objects):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.objects = objects
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        namespaces = [object_namespace(obj.resolve(context)) for obj in self.objects]
+        key = 'fragment:{}:{}'.format(self.fragment_name, ':'.join(namespaces))
+        html = get_or_build_tracked(
+            key, lambda: str(self.nodelist.render(context)), timeout, *namespaces
+        )
+        return mark_safe(html)
+
+
+@register.tag
+def cachedeps(parser, token):
+    nodelist = parser.parse(('endcachedeps',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError("'%r' tag requires at least 2 arguments." % bits[0])
+    return CacheDepsNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        bits[2],
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
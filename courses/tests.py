@@ -1,3 +1,1172 @@
-from django.test import TestCase
+import base64
+import copy
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import cache as catalog_cache, thumbnails, uploads
+from .backends.memcached import KetamaRing, PooledMemcachedCache
+from .backends.standin import MemcachedStandIn
+from .cache import subject_namespace, course_namespace
+from .catalog import build_subjects_snapshot, build_courses_snapshot, load_courses
+from .counters import reconcile
+from .management.commands.audit_query_plans import full_scans
+from .models import Subject, Course, Module, Content, Text, Video, Image, Upload, prefetch_items
+from .ordering import bulk_reorder
+from .querybudget import QueryBudgetExceeded, QueryBudgetTestMixin, query_shape
+from .rendering import item_html_key, prefetch_rendered, render_item
+from .search import search
+from .telemetry import Telemetry, namespace_of
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheTestCase(TestCase):
+    """Every test starts with an empty cache, both tiers."""
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local_cache.clear()
+        catalog_cache.local_generations.clear()
+        self.addCleanup(catalog_cache.local_generations.clear)
+        self.addCleanup(catalog_cache.local_cache.clear)
+
+
+def create_course(with_module=True, **owner_fields):
+    """The owner, the subject Mathematics, its course Algebra and (with_module) the module Groups."""
+    owner = User.objects.create_user('owner', **owner_fields)
+    subject = Subject.objects.create(title='Mathematics', slug='mathematics')
+    course = Course.objects.create(owner=owner, subject=subject, title='Algebra', slug='algebra',
+                                   overview='overview')
+    module = None
+    if with_module:
+        module = Module.objects.create(course=course, title='Groups', description='description')
+    return owner, subject, course, module
+
+
+class NamespaceTests(CacheTestCase):
+    def generations(self, *namespaces):
+        return catalog_cache.get_generations(*namespaces)
+
+    def changed(self, before):
+        after = self.generations(*before)
+        return {ns for ns in before if after[ns] != before[ns]}
+
+    def test_the_signals_bump_only_what_changed(self):
+        owner, maths, course, _ = create_course(with_module=False)
+        physics = Subject.objects.create(title='Physics', slug='physics')
+        namespaces = ('subjects', 'courses', subject_namespace(maths.id), subject_namespace(physics.id),
+                      course_namespace(course.id))
+
+        before = self.generations(*namespaces)
+        module = Module.objects.create(course=course, title='Groups', description='d')
+        self.assertEqual(self.changed(before), {'courses', subject_namespace(maths.id), course_namespace(course.id)})
+
+        # the catalog only shows the number of modules
+        before = self.generations(*namespaces)
+        module.title = 'Rings'
+        module.save()
+        self.assertEqual(self.changed(before), {course_namespace(course.id)})
+
+        # both subject lists change when a course moves
+        before = self.generations(*namespaces)
+        course.subject = physics
+        course.save()
+        self.assertEqual(self.changed(before), set(namespaces))
+
+    def test_a_bump_makes_the_old_entries_unreachable(self):
+        key = catalog_cache.versioned_key('all_subjects', 'subjects')
+        cache.set(key, 'old')
+        catalog_cache.bump('subjects')
+        self.assertNotEqual(catalog_cache.versioned_key('all_subjects', 'subjects'), key)
+
+
+class CatalogSnapshotTests(CacheTestCase):
+    def test_snapshots_are_plain_tuples(self):
+        owner, subject, course, module = create_course(first_name='Ada', last_name='Lovelace')
+        self.assertEqual(build_subjects_snapshot(), ((subject.id, 'Mathematics', 'mathematics', 1), ))
+        snapshot = build_courses_snapshot(subject.id)
+        self.assertEqual(snapshot, (('Algebra', 'algebra', 'mathematics', 'Mathematics', 'Ada Lovelace', 1), ))
+        self.assertEqual(load_courses(snapshot)[0].owner_name, 'Ada Lovelace')
+        self.assertEqual(build_courses_snapshot(0), ())
+
+    def test_renaming_the_instructor_changes_the_list(self):
+        owner, subject, course, _ = create_course(with_module=False, first_name='Ada', last_name='Lovelace')
+        self.assertContains(self.client.get('/'), 'Ada Lovelace')
+        owner.last_name = 'Byron'
+        owner.save()
+        self.assertContains(self.client.get('/'), 'Ada Byron')
+        self.assertContains(self.client.get('/course/subject/mathematics/'), 'Ada Byron')
+
+
+class ContentItemsTests(CacheTestCase):
+    def test_one_query_per_content_type(self):
+        owner, subject, course, module = create_course()
+        for i in range(6):
+            Content.objects.create(module=module, item=Text.objects.create(owner=owner, title='t', content='c'))
+            Content.objects.create(module=module, item=Video.objects.create(owner=owner, title='v',
+                                                                            url='https://example.com/'))
+        # the contents, then the texts and the videos
+        with self.assertNumQueries(3):
+            items = [content.item for content in Content.objects.filter(module=module).with_items()]
+        self.assertEqual([item._meta.model_name for item in items], ['text', 'video'] * 6)
+        contents = list(module.contents.all())
+        with self.assertNumQueries(2):
+            prefetch_items(contents)
+            [content.item for content in contents]
+
+
+class ItemHtmlTests(CacheTestCase):
+    def test_rendered_once_per_version(self):
+        owner = User.objects.create_user('owner')
+        texts = [Text.objects.create(owner=owner, title='t', content='text {}'.format(i)) for i in range(3)]
+        with mock.patch('courses.rendering.render_item', wraps=render_item) as render:
+            prefetch_rendered(texts)
+            self.assertEqual(render.call_count, 3)
+            fresh = list(Text.objects.filter(id__in=[text.id for text in texts]).order_by('id'))
+            prefetch_rendered(fresh)
+            self.assertEqual(render.call_count, 3)
+        self.assertEqual(fresh[1].render().strip(), '<p>text 1</p>')
+
+        # a saved item gets a new key, a deleted one loses its html
+        texts[1].content = 'changed'
+        texts[1].save()
+        self.assertEqual(Text.objects.get(id=texts[1].id).render().strip(), '<p>changed</p>')
+        key = item_html_key(texts[2])
+        texts[2].delete()
+        self.assertIsNone(cache.get(key))
+
+
+class CacheDepsTests(CacheTestCase):
+    template = Template(
+        '{% load course %}{% cachedeps 600 contents module %}'
+        '{% for content in module.contents.all|rendered %}{{ content.item.render }}{% endfor %}'
+        '{% endcachedeps %}'
+    )
+
+    def render(self, module):
+        return self.template.render(Context({'module': Module.objects.get(id=module.id)})).split()
+
+    def test_the_fragment_follows_its_dependencies(self):
+        owner, subject, course, module = create_course()
+        text = Text.objects.create(owner=owner, title='t', content='first')
+        Content.objects.create(module=module, item=text)
+        self.assertEqual(self.render(module), ['<p>first</p>'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.template.render(Context({'module': module})).split(), ['<p>first</p>'])
+
+        # an item recorded while rendering
+        text.content = 'edited'
+        text.save()
+        self.assertEqual(self.render(module), ['<p>edited</p>'])
+        # the module passed to the tag
+        Content.objects.create(module=module, item=Text.objects.create(owner=owner, title='t', content='second'))
+        self.assertEqual(self.render(module), ['<p>edited</p>', '<p>second</p>'])
+        # modules with the same title and order don't share a fragment
+        other = Module.objects.create(course=course, title='Groups', description='d', order=module.order)
+        self.assertEqual(self.render(other), [])
+
+
+class ReorderTests(CacheTestCase):
+    def test_only_the_own_rows_are_reordered(self):
+        owner, subject, course, _ = create_course(with_module=False)
+        other = User.objects.create_user('other')
+        foreign = Course.objects.create(owner=other, subject=subject, title='Logic', slug='logic', overview='o')
+        first, second = [Module.objects.create(course=course, title='m', description='d') for i in range(2)]
+        theirs = Module.objects.create(course=foreign, title='m', description='d')
+        self.client.force_login(owner)
+        response = self.client.post('/course/module/order/', json.dumps({
+            first.id: 1, second.id: 0, theirs.id: 5, 0: 2, 'x': 1, str(first.id + 1000): 3,
+        }), content_type='application/json')
+        self.assertEqual(sorted(response.json()['rejected'], key=str),
+                         sorted([theirs.id, 0, 'x', first.id + 1000], key=str))
+        orders = dict(Module.objects.values_list('id', 'order'))
+        self.assertEqual((orders[first.id], orders[second.id], orders[theirs.id]), (1, 0, 0))
+
+    def test_rejects_negative_orders(self):
+        owner, subject, course, module = create_course()
+        updated, rejected = bulk_reorder(Module.objects.filter(course__owner=owner), {module.id: -1})
+        self.assertEqual((updated, rejected), ([], [module.id]))
+
+
+class OrderFieldTests(CacheTestCase):
+    def setUp(self):
+        super(OrderFieldTests, self).setUp()
+        self.course = create_course(with_module=False)[2]
+
+    def orders(self):
+        return list(self.course.modules.values_list('order', flat=True))
+
+    def module(self, **kwargs):
+        return Module(course=self.course, title='m', description='d', **kwargs)
+
+    def test_bulk_create_reserves_a_block(self):
+        self.module().save()
+        Module.objects.bulk_create([self.module() for i in range(3)] + [self.module(order=10)])
+        self.module().save()
+        self.assertEqual(self.orders(), [0, 1, 2, 3, 10, 11])
+
+    def test_the_orders_written_directly_are_taken_into_account(self):
+        first, second = self.module(), self.module()
+        first.save()
+        second.save()
+        # i.e. bulk_reorder or loaddata, without the field
+        Module.objects.filter(id=second.id).update(order=7)
+        third = self.module()
+        third.save()
+        self.assertEqual(self.orders(), [0, 7, 8])
+        bulk_reorder(Module.objects.all(), {second.id: 1, third.id: 2})
+        self.module().save()
+        self.assertEqual(self.orders(), [0, 1, 2, 3])
+
+    def test_objects_created_at_the_same_time(self):
+        # both read the same highest order before any of them is saved
+        field = Module._meta.get_field('order')
+        scope = {'course_id': self.course.id}
+        self.assertEqual([field.allocate(scope), field.allocate(scope, 2)], [0, 1])
+
+    def test_overlapping_inserts(self):
+        field = Module._meta.get_field('order')
+        scope = {'course_id': self.course.id}
+        self.module().save()
+        # the counter was evicted: A reads the highest order, then B is saved and C is given
+        # an order before A gets to the counter
+        cache.clear()
+        read, others = field.get_last_order, []
+
+        def read_then_wait(scope):
+            last = read(scope)
+            if not others:
+                others.append(self.module())
+                others[0].save()
+                others.append(field.allocate(scope))
+            return last
+
+        with mock.patch.object(field, 'get_last_order', side_effect=read_then_wait):
+            first = field.allocate(scope)
+        self.assertEqual(sorted([first, others[0].order, others[1]]), [1, 2, 3])
+
+    def test_no_query_once_the_counter_runs(self):
+        self.module().save()
+        field = Module._meta.get_field('order')
+        with mock.patch.object(field, 'get_last_order') as read:
+            self.module().save()
+        read.assert_not_called()
+        self.assertEqual(self.orders(), [0, 1])
+
+    def test_without_the_cache(self):
+        self.module().save()
+        with mock.patch('courses.fields.cache.incr', side_effect=ValueError):
+            self.module().save()
+        self.assertEqual(self.orders(), [0, 1])
+
+
+class ContentsEtagTests(CacheTestCase):
+    def setUp(self):
+        super(ContentsEtagTests, self).setUp()
+        owner, subject, self.course, self.module = create_course()
+        student = User.objects.create_user('student', password='secret')
+        self.text = Text.objects.create(owner=owner, title='t', content='first')
+        Content.objects.create(module=self.module, item=self.text)
+        self.course.students.add(student)
+        self.url = '/api/courses/{}/contents/'.format(self.course.id)
+        self.auth = {'HTTP_AUTHORIZATION': 'Basic {}'.format(base64.b64encode(b'student:secret').decode())}
+
+    def get(self, etag=None):
+        headers = dict(self.auth)
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(self.url, **headers)
+
+    def test_not_modified_until_the_course_changes(self):
+        response = self.get()
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.get(etag).status_code, 304)
+        with self.assertNumQueries(1):
+            # the user of the basic authentication, then the enrollment index and the cached entry
+            self.assertEqual(self.get('"other", {}'.format(etag)).status_code, 304)
+
+        self.text.content = 'edited'
+        self.text.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['modules'][0]['contents'][0]['item'].strip(), '<p>edited</p>')
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.module.title = 'Rings'
+        self.module.save()
+        self.assertEqual(self.get(etag).status_code, 200)
+
+
+class CoursePaginationTests(CacheTestCase):
+    def test_walk_the_pages_both_ways(self):
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Mathematics', slug='mathematics')
+        ids = [Course.objects.create(owner=owner, subject=subject, title='Course', slug='course-{}'.format(i),
+                                     overview='o').id for i in range(8)]
+        # most of them created at the same moment, the id decides
+        Course.objects.filter(id__in=ids[2:7]).update(created=Course.objects.get(id=ids[2]).created)
+        pages, url = [], '/api/courses/?page_size=3'
+        while url:
+            response = self.client.get(url).json()
+            pages.append([course['id'] for course in response['results']])
+            url = response['next']
+        self.assertEqual(pages, [ids[0:3], ids[3:6], ids[6:8]])
+        backwards = []
+        while url != response['previous'] and response['previous']:
+            url = response['previous']
+            response = self.client.get(url).json()
+            backwards.append([course['id'] for course in response['results']])
+        self.assertEqual(backwards, [ids[3:6], ids[0:3]])
+        self.assertEqual(self.client.get('/api/courses/', {'cursor': base64.b64encode(b'p=nope|1').decode()}).status_code, 404)
+
+
+class CatalogExportTests(CacheTestCase):
+    def test_one_line_per_object(self):
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Mathématiques', slug='mathematiques')
+        course = Course.objects.create(owner=owner, subject=subject, title='Algebra', slug='algebra', overview='o')
+        module = Module.objects.create(course=course, title='Groups', description='d')
+        text = Text.objects.create(owner=owner, title='t', content='c')
+        Content.objects.create(module=module, item=text)
+        stdout = io.StringIO()
+        call_command('export_catalog', chunk_size=1, stdout=stdout)
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['subject', 'course', 'module', 'content'])
+        self.assertEqual(lines[0]['title'], 'Mathématiques')
+        self.assertEqual(lines[2]['course'], course.id)
+        self.assertEqual((lines[3]['item_type'], lines[3]['item_id']), ('text', text.id))
+
+        # the same lines from the api, for the staff only
+        self.client.force_login(owner)
+        self.assertEqual(self.client.get('/api/catalog/export/').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get('/api/catalog/export/')
+        self.assertEqual(b''.join(response.streaming_content).decode(), stdout.getvalue())
+
+
+class LocalCacheTests(SimpleTestCase):
+    def test_least_recently_used_goes_first(self):
+        local = catalog_cache.LocalCache(2, 60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertEqual((local.get('a'), local.get('b'), local.get('c')), (1, None, 3))
+
+    def test_timeout(self):
+        local = catalog_cache.LocalCache(2, 60)
+        with mock.patch('courses.cache.time.monotonic', return_value=1000):
+            local.set('a', 1)
+        with mock.patch('courses.cache.time.monotonic', return_value=1059):
+            self.assertEqual(local.get('a'), 1)
+        with mock.patch('courses.cache.time.monotonic', return_value=1061):
+            self.assertIsNone(local.get('a'))
+        self.assertEqual(len(local), 0)
+
+
+class LocalTierTests(CacheTestCase):
+    def test_hits_without_memcached(self):
+        compute = mock.Mock(return_value='value')
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'value')
+        with mock.patch('courses.cache.cache') as shared:
+            self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'value')
+        self.assertEqual(shared.method_calls, [])
+        self.assertEqual(compute.call_count, 1)
+
+    def test_bumps_of_the_other_processes(self):
+        compute = mock.Mock(side_effect=['old', 'new'])
+        catalog_cache.get_or_compute('key', compute, 60, 'test')
+        # another process bumps the namespace: this one doesn't see it
+        # until it reads the generations again
+        cache.incr(catalog_cache.GENERATION_KEY.format('test'))
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'old')
+        catalog_cache.local_generations.clear()
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'new')
+        # its own bumps right away
+        compute.side_effect = ['newer']
+        catalog_cache.bump('test')
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'newer')
+
+
+class UnreachableCache(object):
+    """What the pooled memcached backend does when its nodes are down."""
+
+    def get(self, key, default=None):
+        return default
+
+    def get_many(self, keys):
+        return {}
+
+    def add(self, key, value, timeout=None):
+        return False
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class StampedeTests(CacheTestCase):
+    def real_key(self, key):
+        return catalog_cache.versioned_key(key, 'test', local=True)
+
+    def test_the_others_serve_the_stale_value(self):
+        compute = mock.Mock(side_effect=['old', 'new'])
+        catalog_cache.get_or_compute('key', compute, 60, 'test')
+        catalog_cache.bump('test')
+        cache.add('lock:{}'.format(self.real_key('key')), 1)
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'old')
+        self.assertEqual(compute.call_count, 1)
+
+    def test_wait_while_the_lock_is_held(self):
+        real_key = self.real_key('key')
+        cache.add('lock:{}'.format(real_key), 1)
+        compute = mock.Mock(return_value='mine')
+        # the worker holding the lock stores its value a bit later
+        timer = threading.Timer(0.1, lambda: cache.set(real_key, ('theirs', 0.1, time.time() + 60)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'theirs')
+        compute.assert_not_called()
+
+    def test_stop_waiting_when_the_lock_is_gone(self):
+        lock_key = 'lock:{}'.format(self.real_key('key'))
+        cache.add(lock_key, 1)
+        # the worker holding the lock failed
+        timer = threading.Timer(0.1, lambda: cache.delete(lock_key))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.time()
+        self.assertEqual(catalog_cache.get_or_compute('key', lambda: 'mine', 60, 'test'), 'mine')
+        self.assertLess(time.time() - start, catalog_cache.COMPUTE_WAIT / 2)
+
+    def test_compute_right_away_when_the_cache_is_down(self):
+        compute = mock.Mock(return_value='value')
+        start = time.time()
+        with mock.patch('courses.cache.cache', UnreachableCache()):
+            self.assertEqual(catalog_cache.get_or_compute('a', compute, 60, 'test'), 'value')
+            values = async_to_sync(catalog_cache.aget_or_compute_many)(
+                ('b', compute, 60, ('test', )), ('c', compute, 60, ('test', ))
+            )
+        self.assertEqual(values, ['value', 'value'])
+        self.assertEqual(compute.call_count, 3)
+        self.assertLess(time.time() - start, catalog_cache.COMPUTE_WAIT / 2)
+
+    def test_early_refresh(self):
+        # took 10s to compute and expires in 5s
+        real_key = self.real_key('key')
+        cache.set(real_key, ('old', 10, time.time() + 5))
+        compute = mock.Mock(return_value='new')
+        # most of the time it's used as it is
+        with mock.patch('courses.cache.random.random', return_value=0.1):
+            self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'old')
+        catalog_cache.local_cache.clear()
+        # -log(1 - 0.99) * 10 > 5, refreshed before it expires
+        with mock.patch('courses.cache.random.random', return_value=0.99):
+            # unless another worker is already refreshing it
+            lock_key = 'lock:{}'.format(real_key)
+            cache.add(lock_key, 1)
+            self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'old')
+            cache.delete(lock_key)
+            self.assertEqual(catalog_cache.get_or_compute('key', compute, 60, 'test'), 'new')
+        self.assertIsNone(cache.get(lock_key))
+        self.assertEqual(compute.call_count, 1)
+
+
+class SearchTests(CacheTestCase):
+    def test_the_best_matches_of_the_whole_index(self):
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Mathematics', slug='mathematics')
+        course = Course.objects.create(owner=owner, subject=subject, title='Topology', slug='topology',
+                                       overview='open sets')
+        # many newer documents which only mention the word
+        for i in range(30):
+            Module.objects.create(course=course, title='Module {}'.format(i),
+                                  description='a few words about topology and other things')
+        results = search('topology', limit=5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual((results[0]['kind'], results[0]['id']), ('course', course.id))
+        self.assertEqual(str(results[0]['title']), '<mark>Topology</mark>')
+
+    def test_text_contents_are_found_in_the_users_courses_only(self):
+        owner = User.objects.create_user('owner')
+        student = User.objects.create_user('student')
+        subject = Subject.objects.create(title='Mathematics', slug='mathematics')
+        course = Course.objects.create(owner=owner, subject=subject, title='Topology', slug='topology',
+                                       overview='open sets')
+        module = Module.objects.create(course=course, title='Spaces', description='description')
+        text = Text.objects.create(owner=owner, title='Compactness', content='every open cover has a finite subcover')
+        Content.objects.create(module=module, item=text)
+
+        def kinds(user):
+            return [result['kind'] for result in search('open', user=user)]
+
+        self.assertEqual(kinds(None), ['course'])
+        self.assertEqual(kinds(AnonymousUser()), ['course'])
+        self.assertEqual(kinds(student), ['course'])
+        course.students.add(student)
+        self.assertEqual(sorted(kinds(student)), ['course', 'text'])
+        self.assertEqual(sorted(kinds(owner)), ['course', 'text'])
+        # the api and the page search for the logged in user
+        self.assertEqual(len(self.client.get('/api/search/?q=cover').json()['results']), 0)
+        self.assertNotContains(self.client.get('/course/search/?q=cover'), 'subcover')
+        self.client.force_login(student)
+        self.assertEqual(len(self.client.get('/api/search/?q=cover').json()['results']), 1)
+        self.assertContains(self.client.get('/course/search/?q=cover'), 'subcover')
+
+
+class KetamaRingTests(SimpleTestCase):
+    def test_adding_a_node_moves_a_fraction_of_the_keys(self):
+        ring = KetamaRing()
+        for node in ('a:11211', 'b:11211', 'c:11211'):
+            ring.add_node(node)
+        keys = ['key-{}'.format(i) for i in range(5000)]
+        before = {key: ring.get_node(key) for key in keys}
+        ring.add_node('d:11211')
+        moved = [key for key in keys if ring.get_node(key) != before[key]]
+        # about a quarter of the keys go to the new node, and only to the new node
+        self.assertLess(len(moved), len(keys) * 0.35)
+        self.assertTrue(all(ring.get_node(key) == 'd:11211' for key in moved))
+
+    def test_empty_ring(self):
+        self.assertIsNone(KetamaRing().get_node('key'))
+
+    def test_nodes_removed_and_added_while_reading(self):
+        ring = KetamaRing()
+        for node in ('a:11211', 'b:11211'):
+            ring.add_node(node)
+        errors, stop = [], threading.Event()
+
+        def read():
+            while not stop.is_set():
+                try:
+                    # a (points, nodes) pair of two different rings would give an IndexError
+                    if ring.get_node('key-{}'.format(random.random())) not in ('a:11211', 'b:11211'):
+                        errors.append('unknown node')
+                except Exception as error:
+                    errors.append(error)
+
+        readers = [threading.Thread(target=read) for i in range(4)]
+        for reader in readers:
+            reader.start()
+        for i in range(200):
+            ring.remove_node('b:11211')
+            ring.add_node('b:11211')
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+class PooledMemcachedCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.nodes = [MemcachedStandIn().start() for i in range(3)]
+        self.cache = PooledMemcachedCache([node.location for node in self.nodes], {})
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+
+    def test_keys_are_spread_over_the_nodes(self):
+        self.cache.set_many({'key-{}'.format(i): i for i in range(300)})
+        for node in self.nodes:
+            self.assertGreater(len(node.keys()), 50)
+        values = self.cache.get_many(['key-{}'.format(i) for i in range(300)] + ['missing'])
+        self.assertEqual(values, {'key-{}'.format(i): i for i in range(300)})
+
+    def test_get_many_sends_one_request_per_node(self):
+        self.cache.set_many({'key-{}'.format(i): i for i in range(300)})
+        self.cache.get_many(['key-{}'.format(i) for i in range(300)])
+        self.assertEqual(sum(node.stats()['cmd_get'] for node in self.nodes), 300)
+        self.assertEqual(sum(node.stats()['get_hits'] for node in self.nodes), 300)
+
+    def test_basic_operations(self):
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.assertEqual(self.cache.incr('counter', 10), 11)
+        self.assertEqual(self.cache.decr('counter', 2), 9)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('value', {'a': [1, 2]}, None)
+        self.assertEqual(self.cache.get('value'), {'a': [1, 2]})
+        self.assertTrue(self.cache.delete('value'))
+        self.assertEqual(self.cache.get('value', 'default'), 'default')
+        self.cache.set_many({'x': 1, 'y': 2, 'z': 3})
+        self.cache.delete_many(['x', 'y', 'z'])
+        self.assertEqual(self.cache.get_many(['x', 'y', 'z']), {})
+
+    def test_clients_are_shared_between_cache_objects(self):
+        other = PooledMemcachedCache([node.location for node in self.nodes], {})
+        self.assertIs(self.cache._cache, other._cache)
+
+    def test_a_node_which_is_down_behaves_like_an_empty_cache(self):
+        self.cache.set_many({'key-{}'.format(i): i for i in range(30)})
+        self.nodes[0].stop()
+        values = self.cache.get_many(['key-{}'.format(i) for i in range(30)])
+        self.assertLess(len(values), 30)
+        with self.assertRaises(ValueError):
+            for i in range(30):
+                self.cache.incr('key-{}'.format(i))
+
+    def test_stats_of_every_node(self):
+        stats = dict(self.cache._cache.get_stats())
+        self.assertEqual(sorted(stats), sorted(node.location for node in self.nodes))
+
+
+class TelemetryTests(SimpleTestCase):
+    def test_namespace_of(self):
+        self.assertEqual(namespace_of('subject_12_courses:1700000000000'), 'subject_*_courses')
+        self.assertEqual(namespace_of(b'all_courses:1700000000000'), 'all_courses')
+        self.assertEqual(namespace_of('generation:course_3'), 'generation')
+        self.assertEqual(namespace_of('views.decorators.cache.cache_page.config.GET.abc.def.en-us'), 'cache_page')
+        self.assertEqual(namespace_of('template.cache.sidebar.d41d8cd98f00b204e9800998ecf8427e'),
+                         'template.cache.sidebar')
+        self.assertEqual(namespace_of('fragment:module_contents:module_7:course_3'), 'fragment:module_contents')
+        self.assertEqual(namespace_of('lock:subject_12_courses:1700000000000'), 'lock:subject_*_courses')
+        self.assertEqual(namespace_of('stale:all_courses'), 'stale:all_courses')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_flush_adds_to_the_shared_counters(self):
+        cache.clear()
+        recorder = Telemetry()
+        recorder.record_reads(['all_courses'], {'all_courses'}, 0.001)
+        recorder.flush()
+        recorder.record_reads(['all_courses', 'all_subjects'], set(), 0.001)
+        # the counters which exist are only incremented, the others are made
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            recorder.flush()
+        self.assertEqual(sorted(call.args[0] for call in add.call_args_list),
+                         ['telemetry:all_courses:misses', 'telemetry:all_subjects:misses', 'telemetry:all_subjects:read_us',
+                          'telemetry:all_subjects:reads'])
+        self.assertEqual(cache.get_many(['telemetry:all_courses:hits', 'telemetry:all_courses:misses']),
+                         {'telemetry:all_courses:hits': 1, 'telemetry:all_courses:misses': 1})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CounterTests(TestCase):
+    def counters(self, course):
+        course.refresh_from_db()
+        return course.subject.course_count, course.module_count, course.content_count, course.student_count
+
+    def test_the_counters_follow_the_changes(self):
+        owner = User.objects.create_user('owner')
+        students = [User.objects.create_user('student-{}'.format(i)) for i in range(3)]
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        course = Course.objects.create(owner=owner, subject=subject, title='Course', slug='course', overview='o')
+        modules = [Module.objects.create(course=course, title='Module', description='d') for i in range(2)]
+        for module in modules:
+            Content.objects.create(module=module, item=Text.objects.create(owner=owner, title='t', content='c'))
+        course.students.add(*students)
+        self.assertEqual(self.counters(course), (1, 2, 2, 3))
+
+        # an object in memory with old counters doesn't overwrite them
+        stale = Course.objects.get(pk=course.pk)
+        modules[0].delete()
+        students[0].courses_joined.clear()
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counters(course), (1, 1, 1, 2))
+        self.assertEqual(reconcile(dry_run=True), dict.fromkeys(
+            ['subject.course_count', 'course.module_count', 'course.content_count', 'course.student_count'], 0))
+
+    def test_reconcile_fixes_the_drift(self):
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        course = Course.objects.create(owner=owner, subject=subject, title='Course', slug='course', overview='o')
+        # bulk_create doesn't send the signals
+        Module.objects.bulk_create([Module(course=course, title='Module', description='d') for i in range(3)])
+        self.assertEqual(reconcile()['course.module_count'], 1)
+        self.assertEqual(self.counters(course), (1, 3, 0, 0))
+
+    def test_removing_what_isnt_there_takes_nothing(self):
+        owner = User.objects.create_user('owner')
+        student, stranger = User.objects.create_user('student'), User.objects.create_user('stranger')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        course = Course.objects.create(owner=owner, subject=subject, title='Course', slug='course', overview='o')
+        course.students.add(student)
+        course.students.remove(stranger)
+        stranger.courses_joined.remove(course)
+        self.assertEqual(self.counters(course), (1, 0, 0, 1))
+        course.students.remove(student, stranger)
+        self.assertEqual(self.counters(course), (1, 0, 0, 0))
+
+    def test_never_below_zero(self):
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        course = Course.objects.create(owner=owner, subject=subject, title='Course', slug='course', overview='o')
+        # never counted, bulk_create doesn't send the signals
+        Module.objects.bulk_create([Module(course=course, title='Module', description='d') for i in range(2)])
+        module = course.modules.first()
+        Content.objects.bulk_create([Content(module=module, item=Text.objects.create(owner=owner, title='t',
+                                                                                     content='c'))])
+        module.contents.first().delete()
+        module.delete()
+        self.assertEqual(self.counters(course), (1, 0, 0, 0))
+
+
+class BenchmarkHttpTests(TestCase):
+    def test_every_endpoint_is_measured(self):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, output)
+        call_command('benchmark_http', subjects=2, courses=4, modules=2, contents=2, students=3,
+                     requests=4, targets=2, output=output, label='test', stdout=io.StringIO())
+        with open(output) as results:
+            results = json.load(results)
+        self.assertEqual(results['label'], 'test')
+        self.assertEqual(len(results['endpoints']), 7)
+        for name, result in results['endpoints'].items():
+            self.assertEqual(result['status'], [200], name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreater(result['bytes_per_request'], 0)
+
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_the_main_endpoints_use_indexes(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        # --fail raises CommandError when a query scans a whole table
+        call_command('audit_query_plans', subjects=2, courses=6, modules=3, contents=3, students=3,
+                     fail=True, stdout=stdout, stderr=stderr)
+        self.assertIn('no full table scan', stdout.getvalue())
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_full_scans(self):
+        plan = ['SCAN courses_content', 'SEARCH courses_module USING INDEX courses_mod_course__20183c_idx (course_id=?)']
+        self.assertEqual(full_scans('SELECT * FROM courses_content WHERE object_id = %s', plan),
+                         ['SCAN courses_content'])
+        # listing a whole table is expected to read it
+        self.assertEqual(full_scans('SELECT * FROM courses_content', plan), [])
+        self.assertEqual(full_scans('SELECT * FROM courses_course WHERE id > %s',
+                                    ['SCAN courses_course USING INDEX courses_cou_created_36197f_idx']), [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', first_name='Ada', last_name='Lovelace')
+        cls.student = User.objects.create_user('student')
+        subjects = [Subject.objects.create(title='Subject {}'.format(i), slug='subject-{}'.format(i))
+                    for i in range(2)]
+        # a few of everything, so an N+1 shows up as more queries
+        cls.courses = []
+        for i in range(4):
+            course = Course.objects.create(owner=cls.owner, subject=subjects[i % 2], title='Course {}'.format(i),
+                                           slug='course-{}'.format(i), overview='overview')
+            course.students.add(cls.student)
+            for j in range(3):
+                module = Module.objects.create(course=course, title='Module {}'.format(j), description='description')
+                for k in range(3):
+                    text = Text.objects.create(owner=cls.owner, title='Text {}'.format(k), content='text')
+                    Content.objects.create(module=module, item=text)
+            cls.courses.append(course)
+
+    def setUp(self):
+        # every page is measured with an empty cache
+        cache.clear()
+        catalog_cache.local_cache.clear()
+        catalog_cache.local_generations.clear()
+        self.addCleanup(catalog_cache.local_generations.clear)
+        self.addCleanup(catalog_cache.local_cache.clear)
+
+    def test_catalog_pages(self):
+        course = self.courses[0]
+        self.assertQueryBudget('/')
+        self.assertQueryBudget('/course/subject/{}/'.format(course.subject.slug))
+        self.assertQueryBudget('/course/{}/'.format(course.slug))
+        self.assertQueryBudget('/api/courses/')
+        self.assertQueryBudget('/api/courses/{}/'.format(course.id))
+        self.assertQueryBudget('/api/subjects/')
+        response = self.assertQueryBudget('/course/search/?q=cours')
+        self.assertContains(response, '<mark>Course</mark>')
+        # the text contents are only found by the students and the owner
+        response = self.assertQueryBudget('/api/search/?q=text')
+        self.assertEqual(response.json()['results'], [])
+        self.client.force_login(self.student)
+        response = self.assertQueryBudget('/course/search/?q=text')
+        self.assertContains(response, '<mark>text</mark>')
+        response = self.assertQueryBudget('/api/search/?q=text')
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_instructor_pages(self):
+        self.client.force_login(self.owner)
+        course = self.courses[0]
+        self.assertQueryBudget('/course/list/')
+        self.assertQueryBudget('/course/{}/module/'.format(course.id))
+        self.assertQueryBudget('/course/module/{}/'.format(course.modules.first().id))
+
+    def test_student_pages(self):
+        self.client.force_login(self.student)
+        self.assertQueryBudget('/students/courses/')
+        self.assertQueryBudget('/students/course/{}/'.format(self.courses[0].id))
+
+    @override_settings(QUERY_BUDGETS={'course_list': 0}, QUERY_BUDGET_SAMPLE_RATE=1, QUERY_BUDGET_STRICT=True)
+    def test_the_middleware_raises_over_budget_in_strict_mode(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'course_list ran 2 queries'):
+            self.client.get('/')
+
+    @override_settings(QUERY_BUDGETS={'course_list': 0}, QUERY_BUDGET_SAMPLE_RATE=1)
+    def test_the_middleware_logs_a_warning_over_budget(self):
+        with self.assertLogs('courses.queries', 'WARNING'):
+            self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape('SELECT *  FROM "a" WHERE "a"."id" IN (%s, %s, %s) LIMIT 21'),
+            'SELECT * FROM "a" WHERE "a"."id" IN (...) LIMIT ?'
+        )
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner, cls.subject, cls.course, module = create_course(first_name='Ada', last_name='Lovelace')
+        cls.student = User.objects.create_user('student', password='secret')
+        Content.objects.create(module=module, item=Text.objects.create(owner=owner, title='Rings', content='text'))
+        cls.course.students.add(cls.student)
+        # the async client of django 3.1 takes the headers by their http name
+        credentials = base64.b64encode(b'student:secret').decode()
+        cls.basic_auth = {'authorization': 'Basic {}'.format(credentials)}
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local_cache.clear()
+        catalog_cache.local_generations.clear()
+        self.addCleanup(catalog_cache.local_generations.clear)
+        self.addCleanup(catalog_cache.local_cache.clear)
+
+    async def test_catalog_pages(self):
+        response = await self.async_client.get('/')
+        self.assertContains(response, 'Algebra')
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = await self.async_client.get('/course/subject/mathematics/')
+        self.assertContains(response, 'Mathematics Courses')
+        response = await self.async_client.get('/course/subject/physics/')
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get('/course/algebra/')
+        self.assertContains(response, 'Ada Lovelace')
+        response = await self.async_client.post('/')
+        self.assertEqual(response.status_code, 405)
+
+    async def test_subjects_api(self):
+        response = await self.async_client.get('/api/subjects/')
+        self.assertEqual(response.json(), [{'id': self.subject.id, 'title': 'Mathematics', 'slug': 'mathematics'}])
+        response = await self.async_client.get('/api/subject/{}/'.format(self.subject.id))
+        self.assertEqual(response.json()['slug'], 'mathematics')
+        response = await self.async_client.get('/api/subject/0/')
+        self.assertEqual(response.json(), {'detail': 'Not found.'})
+        # the views of rest framework, in a thread, with the browsable api
+        response = await self.async_client.get('/api/subjects/', accept='text/html')
+        self.assertContains(response, 'Subject List')
+
+    async def test_course_contents_api(self):
+        url = '/api/courses/{}/contents/'.format(self.course.id)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="api"')
+        wrong = base64.b64encode(b'student:wrong').decode()
+        response = await self.async_client.get(url, authorization='Basic {}'.format(wrong))
+        self.assertEqual(response.json()['detail'], 'Invalid username/password.')
+        response = await self.async_client.get(url, **self.basic_auth)
+        self.assertEqual(response.json()['modules'][0]['contents'][0]['order'], 0)
+        response = await self.async_client.get(url, **{'if-none-match': response['ETag']}, **self.basic_auth)
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get('/api/courses/0/contents/', **self.basic_auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['detail'], 'You are not enrolled in this course.')
+
+    async def test_catalog_export(self):
+        admin = await sync_to_async(User.objects.create_user)('admin', is_staff=True)
+        await sync_to_async(self.async_client.force_login)(admin)
+        response = await self.async_client.get('/api/catalog/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        # read in the event loop, like the asgi handler does
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['type'] for line in lines], ['subject', 'course', 'module', 'content'])
+
+    async def test_every_missing_key_is_computed_once(self):
+        calls = []
+
+        def compute(name):
+            calls.append(name)
+            return name
+
+        lookups = [(name, lambda name=name: compute(name), 60, ('test', )) for name in ('a', 'b')]
+        self.assertEqual(await catalog_cache.aget_or_compute_many(*lookups), ['a', 'b'])
+        self.assertEqual(await catalog_cache.aget_or_compute_many(*lookups), ['a', 'b'])
+        self.assertEqual(calls, ['a', 'b'])
+
+    @override_settings(QUERY_BUDGETS={'course_list': 0}, QUERY_BUDGET_SAMPLE_RATE=1, QUERY_BUDGET_STRICT=True)
+    async def test_the_middleware_records_the_queries_of_async_views(self):
+        # the async client goes through the async middleware chain
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'course_list ran 2 queries'):
+            await self.async_client.get('/')
+
+class UploadMediaMixin:
+    # the uploads go to a temporary media root, in chunks of 4 bytes
+    def setUp(self):
+        super(UploadMediaMixin, self).setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name, value in (('PARTIAL_DIR', os.path.join(self.media, 'partial')), ('CHUNK_SIZE', 4)):
+            patcher = mock.patch.object(uploads, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ChunkedUploadTests(UploadMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, _, _, cls.module = create_course()
+
+    def setUp(self):
+        super(ChunkedUploadTests, self).setUp()
+        self.client.force_login(self.owner)
+
+    def start(self, size=10):
+        response = self.client.post('/api/uploads/', {
+            'module': self.module.id, 'model_name': 'file', 'title': 'Lecture',
+            'filename': 'lecture.txt', 'size': size,
+        })
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def put(self, url, offset, data, **headers):
+        return self.client.put(url, data, content_type='application/offset+octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def test_upload_in_chunks(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, b'0123').json()['offset'], 4)
+        # a chunk sent twice (i.e. the answer got lost) is refused, the client goes on from the offset
+        response = self.put(url, 0, b'0123')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '4')
+        response = self.put(url, 4, b'4567', HTTP_UPLOAD_CHECKSUM='sha256 {}'.format('0' * 64))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()['offset'], 4)
+        # only the last chunk may be shorter
+        self.assertEqual(self.put(url, 4, b'45').status_code, 400)
+        checksum = 'sha256 {}'.format(hashlib.sha256(b'4567').hexdigest())
+        self.assertEqual(self.put(url, 4, b'4567', HTTP_UPLOAD_CHECKSUM=checksum).status_code, 200)
+        response = self.put(url, 8, b'89')
+        self.assertTrue(response.json()['complete'])
+        digests = b''.join(hashlib.sha256(chunk).digest() for chunk in (b'0123', b'4567', b'89'))
+        self.assertEqual(response.json()['checksum'], '{}-3'.format(hashlib.sha256(digests).hexdigest()))
+
+        content = Content.objects.get(id=response.json()['content'])
+        self.assertEqual(content.module, self.module)
+        with content.item.file.open('rb') as uploaded:
+            self.assertEqual(uploaded.read(), b'0123456789')
+        self.assertEqual(os.listdir(os.path.join(self.media, 'partial')), [])
+        self.assertEqual(self.put(url, 10, b'x').status_code, 409)
+
+    def test_only_in_your_own_modules(self):
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.post('/api/uploads/', {
+            'module': self.module.id, 'model_name': 'file', 'title': 'Lecture',
+            'filename': 'lecture.txt', 'size': 10,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_the_abandoned_uploads(self):
+        url = self.start()
+        self.put(url, 0, b'0123')
+        call_command('purge_uploads', hours=0, stdout=io.StringIO())
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(os.listdir(os.path.join(self.media, 'partial')), [])
+
+
+class SlowStream:
+    """A request body which waits for `go` before it's read."""
+
+    def __init__(self, data, reading, go):
+        self.data, self.reading, self.go = io.BytesIO(data), reading, go
+
+    def read(self, size):
+        self.reading.set()
+        self.go.wait(5)
+        return self.data.read(size)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConcurrentChunkTests(UploadMediaMixin, TransactionTestCase):
+    # two requests for the same upload at once, each one in its own thread and connection
+    def setUp(self):
+        super(ConcurrentChunkTests, self).setUp()
+        owner, _, _, module = create_course()
+        self.upload = Upload.objects.create(owner=owner, module=module, model_name='file', title='Lecture',
+                                            filename='lecture.txt', size=10)
+        self.results = {}
+
+    def send(self, name, stream):
+        try:
+            # a copy, as each request reads its own
+            upload = copy.copy(self.upload)
+            self.results[name] = uploads.append_chunk(upload, 0, stream, 4)
+        except uploads.UploadError as error:
+            self.results[name] = error
+        finally:
+            connection.close()
+
+    def in_thread(self, *args):
+        thread = threading.Thread(target=self.send, args=args)
+        thread.start()
+        return thread
+
+    @skipUnless(uploads.fcntl, 'no flock on this platform')
+    def test_one_chunk_at_a_time(self):
+        reading, go = threading.Event(), threading.Event()
+        first = self.in_thread('first', SlowStream(b'0123', reading, go))
+        self.assertTrue(reading.wait(5))
+        # the first chunk holds the partial file until it's written
+        self.in_thread('second', io.BytesIO(b'abcd')).join()
+        go.set()
+        first.join()
+
+        self.assertIsNone(self.results['first'])
+        self.assertIsInstance(self.results['second'], uploads.ChunkConflict)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.offset, 4)
+        self.assertEqual(self.upload.chunk_digests, hashlib.sha256(b'0123').hexdigest())
+        with open(uploads.partial_path(self.upload), 'rb') as partial:
+            self.assertEqual(partial.read(), b'0123')
+
+    def test_counted_once(self):
+        # without the flock both chunks are written, only the first one moves the offset
+        reading, go = threading.Event(), threading.Event()
+        with mock.patch.object(uploads, 'fcntl', None):
+            first = self.in_thread('first', SlowStream(b'0123', reading, go))
+            self.assertTrue(reading.wait(5))
+            self.in_thread('second', io.BytesIO(b'0123')).join()
+            go.set()
+            first.join()
+
+        self.assertIsNone(self.results['second'])
+        self.assertIsInstance(self.results['first'], uploads.ChunkConflict)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.offset, 4)
+        self.assertEqual(self.upload.chunk_digests, hashlib.sha256(b'0123').hexdigest())
+
+    def test_a_busy_database(self):
+        # another connection holds the write lock of sqlite while the offset is moved
+        writing, done = threading.Event(), threading.Event()
+
+        def write():
+            with transaction.atomic():
+                Upload.objects.filter(pk=self.upload.pk).update(title='Lecture 1')
+                writing.set()
+                done.wait(5)
+            connection.close()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.assertTrue(writing.wait(5))
+        self.in_thread('chunk', io.BytesIO(b'0123')).join()
+        done.set()
+        writer.join()
+
+        self.assertIsInstance(self.results['chunk'], uploads.ChunkConflict)
+        self.upload.refresh_from_db()
+        self.assertEqual((self.upload.offset, self.upload.title), (0, 'Lecture 1'))
+
+
+@skipUnless(thumbnails.available(), 'Pillow is not installed')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # only on the first request, no pool of processes in the tests
+        patcher = mock.patch.object(thumbnails, 'WORKERS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = User.objects.create_user('owner')
+
+    def image(self, data=None):
+        if data is None:
+            output = io.BytesIO()
+            thumbnails.PILImage.new('RGB', (800, 400), 'red').save(output, format='PNG')
+            data = output.getvalue()
+        item = Image(owner=self.owner, title='Diagram')
+        item.file.save('diagram.png', ContentFile(data))
+        return item
+
+    def test_srcset_links_to_the_missing_variants(self):
+        item = self.image()
+        html = render_item(item)
+        # never wider than the upload
+        self.assertIn('/course/image/{}/640.jpeg 640w'.format(item.id), html)
+        self.assertNotIn('1024w', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn(item.file.url, html)
+
+    def test_variant_made_on_first_request(self):
+        item = self.image()
+        response = self.client.get('/course/image/{}/320.jpeg'.format(item.id))
+        self.assertEqual(response.status_code, 302)
+        digest = hashlib.sha256(item.file.read()).hexdigest()
+        name = thumbnails.variant_name(digest, 320, 'jpeg')
+        self.assertEqual(response['Location'], '/media/' + name)
+        with thumbnails.PILImage.open(os.path.join(self.media, name)) as variant:
+            self.assertEqual(variant.size, (320, 160))
+        # the srcset now links to the file itself
+        self.assertIn('/media/{} 320w'.format(name), render_item(item))
+        self.assertEqual(self.client.get('/course/image/{}/1024.jpeg'.format(item.id)).status_code, 404)
+        self.assertEqual(self.client.get('/course/image/{}/320.gif'.format(item.id)).status_code, 404)
+
+    def test_not_a_picture(self):
+        item = self.image(b'not a picture')
+        self.assertEqual(render_item(item).strip(), '<p><img src="{}" alt=""></p>'.format(item.file.url))
+
+    def test_too_many_pixels(self):
+        item = self.image()
+        # over twice the limit Pillow refuses to open it
+        with mock.patch.object(thumbnails.PILImage, 'MAX_IMAGE_PIXELS', 1000):
+            self.assertIsNone(thumbnails.source_info(item))
+        # and it isn't tried again
+        self.assertIsNone(thumbnails.source_info(item))
+        self.assertEqual(self.client.get('/course/image/{}/320.jpeg'.format(item.id)).status_code, 404)
+
+    def test_variants_are_upright(self):
+        # a photo taken on its side, 800x400 as stored, 400x800 once turned
+        output = io.BytesIO()
+        exif = thumbnails.PILImage.Exif()
+        exif[thumbnails.EXIF_ORIENTATION] = 6
+        thumbnails.PILImage.new('RGB', (800, 400), 'red').save(output, format='JPEG', exif=exif)
+        item = self.image(output.getvalue())
+        self.assertNotIn('640w', render_item(item))
+        response = self.client.get('/course/image/{}/320.jpeg'.format(item.id))
+        with thumbnails.PILImage.open(os.path.join(self.media, response['Location'][len('/media/'):])) as variant:
+            self.assertEqual(variant.size, (320, 640))
@@ -0,0 +1,200 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+try:
+    from PIL import Image as PILImage, ImageOps, features
+except ImportError:
+    PILImage = None
+
+from .cache import bump, object_namespace
+from .rendering import item_html_key
+
+# responsive image variants:
+    # the Image contents are shown with a srcset of smaller and recompressed copies (variants)
+    # of the upload, IMAGE_VARIANT_WIDTHS wide, in WebP and JPEG, so the browser downloads
+    # the one that fits the screen instead of the full resolution file
+    # a variant lives at variants/ab/<sha256 of the upload>/<width>.<format> in MEDIA_ROOT, the same
+    # picture uploaded twice shares its variants and a new upload gets new urls by itself
+    # the variants are made lazily: the srcset points to the image_variant view for the
+    # missing ones, which makes the variant on the first request and redirects to the file.
+    # with IMAGE_VARIANT_WORKERS > 0 the missing variants of a rendered image are also made in
+    # a pool of processes in the background, then the cached html of the item is purged so
+    # the next render links to the files directly
+    # the variants are files, they need a storage with a path (FileSystemStorage)
+    # the variants are turned upright from the EXIF orientation of the upload (photos of a phone)
+    # and a picture over the pixel limit of Pillow (a decompression bomb) gets none
+# without Pillow (an optional dependency) the pages keep showing the original file
+
+WIDTHS = tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 1024, 1600)))
+FORMATS = tuple(getattr(settings, 'IMAGE_VARIANT_FORMATS', ('webp', 'jpeg')))
+QUALITY = {'webp': 80, 'jpeg': 82}
+QUALITY.update(getattr(settings, 'IMAGE_VARIANT_QUALITY', {}))
+WORKERS = getattr(settings, 'IMAGE_VARIANT_WORKERS', 2)
+VARIANT_DIR = getattr(settings, 'IMAGE_VARIANT_DIR', 'variants')
+# the digest and the size of the uploads, per item version
+SOURCE_TIMEOUT = 60 * 60 * 24 * 30
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+BLOCK_SIZE = 1024 * 1024
+EXIF_ORIENTATION = 0x0112
+
+
+def available():
+    return PILImage is not None
+
+
+def formats():
+    # Pillow can be built without WebP
+    return tuple(fmt for fmt in FORMATS if fmt != 'webp' or features.check('webp'))
+
+
+def variant_name(digest, width, fmt):
+    return '{}/{}/{}/{}.{}'.format(VARIANT_DIR, digest[:2], digest, width, fmt)
+
+
+def _read_source(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    with PILImage.open(path) as image:
+        width, height = image.size
+        # 5 to 8 are turned by a quarter, the variants are as wide as the upright picture
+        if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        return digest.hexdigest(), (width, height)
+
+
+def source_info(item):
+    """(sha256, (width, height)) of the upload of an Image item, None when it's not a picture."""
+    key = 'image_source:{}:{}'.format(item.pk, item.updated.timestamp() if item.updated else '')
+    info = cache.get(key)
+    if info is None:
+        try:
+            info = _read_source(item.file.path)
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            # not a picture Pillow can read (the Image model takes any file), no file, or too
+            # many pixels to open safely
+            info = ()
+        cache.set(key, info, SOURCE_TIMEOUT)
+    return info or None
+
+
+def widths_for(original_width):
+    # never bigger than the upload, the smallest variant is always there
+    widths = [width for width in WIDTHS if width < original_width]
+    return widths or [min(original_width, WIDTHS[0])]
+
+
+def generate(source, digest, widths, fmts, media_root):
+    """Make the missing variants of `source`. Runs in the pool of processes, so no django here."""
+    made = []
+    with PILImage.open(source) as image:
+        image.load()
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for width in widths:
+            resized = None
+            for fmt in fmts:
+                path = os.path.join(media_root, variant_name(digest, width, fmt))
+                if os.path.exists(path):
+                    continue
+                if resized is None:
+                    height = max(round(image.height * width / image.width), 1)
+                    resized = image.resize((width, height), PILImage.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # written next to its final name and renamed, a reader never sees half a file
+                partial = '{}.{}.tmp'.format(path, os.getpid())
+                output = resized.convert('RGB') if fmt == 'jpeg' else resized
+                output.save(partial, format=fmt.upper(), quality=QUALITY[fmt], optimize=True)
+                os.replace(partial, path)
+                made.append(path)
+    return made
+
+
+_pool = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawned, not forked: a fork would copy the locks and the database and memcached
+        # connections of the server's threads. the new processes set django up to import this module
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=django.setup)
+    return _pool
+
+
+def schedule(item, digest, widths):
+    """Make the variants of `item` in the background (IMAGE_VARIANT_WORKERS processes)."""
+    if not WORKERS:
+        return
+    with _lock:
+        if digest in _pending:
+            return
+        _pending.add(digest)
+        future = _get_pool().submit(generate, item.file.path, digest, widths, formats(), str(settings.MEDIA_ROOT))
+    html_key, namespace = item_html_key(item), object_namespace(item)
+
+    def done(future):
+        with _lock:
+            _pending.discard(digest)
+        if future.exception() is None:
+            # the cached html (and the fragments showing it) still link to the image_variant view
+            cache.delete(html_key)
+            bump(namespace)
+
+    future.add_done_callback(done)
+
+
+def sources(item):
+    """[(mime type, srcset)] of the variants of an Image item, None when there are none."""
+    if not available():
+        return None
+    info = source_info(item)
+    if info is None:
+        return None
+    digest, (original_width, _) = info
+    widths = widths_for(original_width)
+    result = []
+    missing = False
+    for fmt in formats():
+        urls = []
+        for width in widths:
+            name = variant_name(digest, width, fmt)
+            if default_storage.exists(name):
+                url = default_storage.url(name)
+            else:
+                # made on its first request
+                url = reverse('courses:image_variant', args=[item.pk, width, fmt])
+                missing = True
+            urls.append('{} {}w'.format(url, width))
+        result.append((MIME_TYPES[fmt], ', '.join(urls)))
+    if missing:
+        schedule(item, digest, widths)
+    return result
+
+
+def make_variant(item, width, fmt):
+    """Make one variant of `item` now (first request), return its storage name or None."""
+    if not available() or fmt not in formats():
+        return None
+    info = source_info(item)
+    if info is None or width not in widths_for(info[1][0]):
+        return None
+    digest = info[0]
+    name = variant_name(digest, width, fmt)
+    if not default_storage.exists(name):
+        generate(item.file.path, digest, [width], [fmt], str(settings.MEDIA_ROOT))
+    return name
@@ -0,0 +1,173 @@
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import OperationalError, transaction
+from django.utils import timezone
+
+from .models import Content, File, Image, Upload
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# chunked, resumable uploads of File and Image contents:
+    # the client creates an Upload (module, title, file name and size) and sends the file in
+    # fixed-size chunks of UPLOAD_CHUNK_SIZE bytes, each one in its own PUT request with its
+    # offset, so a dropped connection only costs one chunk and no worker is busy for the
+    # whole file. after an interruption the client asks for the offset and goes on from there
+    # every chunk is streamed from the request straight into a partial file (never entirely
+    # in memory) and hashed while it's written. its sha256 is kept on the Upload, the checksum
+    # of the file is the sha256 of these digests ('<hex>-<number of chunks>', like the etag
+    # of an S3 multipart upload), so it never needs to read the file again
+    # with the last chunk the partial file is moved into the storage of the File/Image
+    # (Uploads/courses/...) and the Content is created
+    # one chunk at a time per upload: the partial file is locked (flock, not waiting for it)
+    # while a chunk is written, the lock goes away with the file even when its worker dies.
+    # the offset is then moved with a compare-and-set on the row, so a chunk written where
+    # there's no flock (windows) still can't be counted twice
+# the api is at /api/uploads/, `python manage.py purge_uploads` removes the abandoned uploads
+
+CHUNK_SIZE = getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE', 10 * 1024 * 1024 * 1024)
+PARTIAL_DIR = getattr(settings, 'UPLOAD_PARTIAL_DIR', os.path.join(settings.MEDIA_ROOT, 'partial_uploads'))
+BLOCK_SIZE = 64 * 1024
+
+MODELS = {'file': File, 'image': Image}
+DIGEST_LENGTH = 64
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkConflict(UploadError):
+    """The chunk doesn't start at the offset of the upload (or another one is being written)."""
+
+
+class PartialFile(DjangoFile):
+    # FileSystemStorage moves a file which has a temporary_file_path() instead of copying it,
+    # the other storages read it in chunks
+    def temporary_file_path(self):
+        return self.name
+
+
+def partial_path(upload):
+    return os.path.join(PARTIAL_DIR, '{}.part'.format(upload.pk))
+
+
+def expected_length(upload, offset):
+    return min(CHUNK_SIZE, upload.size - offset)
+
+
+def checksum(upload):
+    digests = upload.chunk_digests
+    count = len(digests) // DIGEST_LENGTH
+    return '{}-{}'.format(hashlib.sha256(bytes.fromhex(digests)).hexdigest(), count)
+
+
+@contextmanager
+def locked_partial(upload):
+    # opened without truncating it, then locked before anything is read or written
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    partial = os.fdopen(os.open(partial_path(upload), os.O_RDWR | os.O_CREAT), 'r+b')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise ChunkConflict('Another chunk of this upload is being written.')
+        yield partial
+    finally:
+        partial.close()
+
+
+@contextmanager
+def busy_database():
+    # i.e. sqlite is busy with another write: nothing was counted, the chunk can be sent again
+    try:
+        yield
+    except OperationalError:
+        raise ChunkConflict('The upload is busy, send the chunk again.')
+
+
+def _write(partial, offset, stream, length):
+    # the chunk goes in place, so a chunk sent again after a failure simply overwrites itself
+    digest = hashlib.sha256()
+    received = 0
+    partial.seek(offset)
+    while received < length:
+        block = stream.read(min(BLOCK_SIZE, length - received))
+        if not block:
+            break
+        partial.write(block)
+        digest.update(block)
+        received += len(block)
+    partial.flush()
+    return received, digest.hexdigest()
+
+
+def append_chunk(upload, offset, stream, length, sha256=None):
+    """Write the chunk of `length` bytes read from `stream` at `offset`.
+
+    raises ChunkConflict when offset isn't the offset of the upload (or another chunk of it is
+    being written), UploadError when the chunk is incomplete or doesn't match `sha256`.
+    returns the Content once the last chunk is in.
+    """
+    if upload.complete:
+        raise ChunkConflict('The upload is already complete.')
+    with locked_partial(upload) as partial:
+        # the offset may have moved since the upload was read
+        with busy_database():
+            upload.refresh_from_db(fields=['offset', 'chunk_digests', 'content'])
+        if upload.complete:
+            raise ChunkConflict('The upload is already complete.')
+        if offset != upload.offset:
+            raise ChunkConflict('The next chunk starts at {}.'.format(upload.offset))
+        if length != expected_length(upload, offset):
+            raise UploadError('The chunk must be {} bytes.'.format(expected_length(upload, offset)))
+        received, digest = _write(partial, offset, stream, length)
+        if received != length:
+            raise UploadError('The chunk is incomplete ({} of {} bytes), send it again.'.format(received, length))
+        if sha256 is not None and sha256.lower() != digest:
+            raise UploadError('The chunk doesn\'t match its sha256, send it again.')
+        with busy_database():
+            claimed = Upload.objects.filter(pk=upload.pk, offset=offset).update(
+                offset=offset + received, chunk_digests=upload.chunk_digests + digest, updated=timezone.now())
+        if not claimed:
+            with busy_database():
+                upload.refresh_from_db(fields=['offset'])
+            raise ChunkConflict('Another chunk of this upload was written first.')
+        upload.offset += received
+        upload.chunk_digests += digest
+        if upload.complete:
+            return assemble(upload)
+        return None
+
+
+def assemble(upload):
+    """Move the partial file into its File/Image and create the Content."""
+    path = partial_path(upload)
+    item = MODELS[upload.model_name](owner=upload.owner, title=upload.title)
+    with transaction.atomic():
+        with open(path, 'rb') as partial:
+            item.file.save(upload.filename, PartialFile(partial, name=path), save=False)
+        item.save()
+        content = Content.objects.create(module=upload.module, item=item)
+        upload.content = content
+        upload.save(update_fields=['content', 'updated'])
+    # a storage which copied the file left the partial one behind
+    if os.path.exists(path):
+        os.remove(path)
+    return content
+
+
+def discard(upload):
+    """Delete an upload and its partial file."""
+    path = partial_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
+    upload.delete()
@@ -18,7 +18,9 @@ urlpatterns = [
     path('module/<int:module_id>/', views.ModuleContentListView.as_view(), name='module_content_list'),
     path('module/order/', views.ModuleOrderView.as_view(), name='module_order'),
     path('content/order/', views.ContentOrderView.as_view(), name='content_order'),
+    path('image/<int:id>/<int:width>.<slug:fmt>', views.image_variant, name='image_variant'),
 
-    path('subject/<str:subject>/', views.CourseListView.as_view(), name="course_list_subject"),
-    path('<slug:slug>/', views.CourseDetailView.as_view(), name="course_detail"),
+    path('search/', views.SearchView.as_view(), name="search"),
+    path('subject/<str:subject>/', views.course_list, name="course_list_subject"),
+    path('<slug:slug>/', views.course_detail, name="course_detail"),
 ]
\ No newline at end of file
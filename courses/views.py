@@ -1,16 +1,32 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.views.generic.base import TemplateResponseMixin, View
 # to know more about django-braces you have check this out https://django-braces.readthedocs.io/
 from braces.views import LoginRequiredMixin, PermissionRequiredMixin, CsrfExemptMixin, JsonRequestResponseMixin
+from django.http import Http404, HttpResponseNotAllowed
 from django.urls import reverse_lazy
 from django.forms.models import modelform_factory
 from django.apps import apps
-from django.db.models import Count 
-from django.core.cache import cache
-
-from . models import Course, Module, Content, Subject
+from django.contrib import admin
+from django.db.models import OuterRef, Subquery
+from django.utils.decorators import method_decorator
+from django.utils.cache import add_never_cache_headers
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+from django.core.files.storage import default_storage
+
+from . models import Course, Module, Content, Image
+from . cache import aget_or_compute, aget_or_compute_many, bump, subject_namespace, course_namespace, module_namespace, \
+    CATALOG_TIMEOUT
+from . catalog import build_subjects_snapshot, build_courses_snapshot, load_subjects, load_courses
 from . forms import ModuleFormSet
+from . search import search
+from . telemetry import collect
+from . ordering import bulk_reorder
+from . import thumbnails
 from students.forms import CourseEnrollForm
 
 
@@ -48,6 +64,12 @@ class OwnerCourseEditMixin(OwnerCourseMixin, OwnerEditMixin):
 class ManageCourseListView(OwnerCourseMixin, ListView):
     template_name = 'courses/manage/course/list.html'
 
+    def get_queryset(self):
+        # the template links to the first module of every course, i get its id in the same
+        # query instead of two queries per course (modules.count and modules.first)
+        first_module = Module.objects.filter(course=OuterRef('pk')).order_by('order').values('id')[:1]
+        return super(ManageCourseListView, self).get_queryset().annotate(first_module_id=Subquery(first_module))
+
 
 # you need to go in '/admin' and create a group for example by the name of 'Instaractor' 
 # then give some permissions like aded course and ...
@@ -190,10 +212,13 @@ class ModuleContentListView(TemplateResponseMixin, View):
 
     def get(self, request, module_id):
         module = get_object_or_404(
-                                    Module,
+                                    Module.objects.select_related('course'),
                                     id=module_id,
                                     course__owner=request.user)
-        return self.render_to_response({'module': module})
+        return self.render_to_response({
+                                        'module': module,
+                                        'contents': module.contents.with_items()
+                                        })
 
 
 # CsrfExemptMixin is to avoid checking for a csrf token in post request
@@ -201,78 +226,154 @@ class ModuleContentListView(TemplateResponseMixin, View):
 # JsonRequestResponseMixin: passes request data as json and also serialize the response json 
 # and return HttpResponse with the application /json content type 
 class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    
+    # require_json answers 400 when the body is not valid json
+    require_json = True
+
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(
-                                id=id,
-                                course__owner=request.user
-                                ).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        if not isinstance(self.request_json, dict):
+            return self.render_bad_request_response()
+        # one ownership query and one update inside a transaction, see courses/ordering.py
+        saved, rejected = bulk_reorder(
+            Module.objects.filter(course__owner=request.user),
+            self.request_json
+        )
+        # the student pages list the modules in order
+        course_ids = Module.objects.filter(id__in=saved)\
+            .values_list('course_id', flat=True).distinct()
+        bump(*[course_namespace(course_id) for course_id in course_ids])
+        return self.render_json_response({'saved': 'OK', 'rejected': rejected})
 
 
 class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
+    require_json = True
 
     def post(self, request):
-        for id, order in self.request_json.items():
-            Content.objects.filter(
-                id=id,
-                module__course__owner=request.user
-            ).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
-
-class CourseListView(TemplateResponseMixin, View):
-    model = Course 
-    template_name = "courses/course/list.html"
-
-    def get(self, request, subject=None):
-        # here i'm gonna implement cache system
-        subjects = cache.get('all_subjects')
-        if not subjects:
-            # retrive all subject with total number of courses contain in each subject
-            subjects = Subject.objects.annotate(
-                total_courses = Count('courses')
-            )
-            # if subjects si not cached so like this we can set to cache
-            cache.set('all_subjects', subjects)
-        all_courses = Course.objects.annotate(
-            total_modules = Count('modules')
+        if not isinstance(self.request_json, dict):
+            return self.render_bad_request_response()
+        saved, rejected = bulk_reorder(
+            Content.objects.filter(module__course__owner=request.user),
+            self.request_json
+        )
+        # update() doesn't send any signal, so i purge the cached fragments of the modules here
+        module_ids = Content.objects.filter(id__in=saved)\
+            .values_list('module_id', flat=True).distinct()
+        bump(*[module_namespace(module_id) for module_id in module_ids])
+        return self.render_json_response({'saved': 'OK', 'rejected': rejected})
+
+
+def require_safe_async(view):
+    """require_safe for async views, the decorators of django 3.1 only wrap sync views."""
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return wraps(view)(wrapper)
+
+
+# the catalog pages are async views (see config/asgi.py), a worker doesn't wait for the cache
+# or the database while it could serve other requests. the cache lookups which don't depend on
+# each other run at the same time, the orm and the templates (they read request.user) run with
+# sync_to_async in the thread django keeps for the database connections
+# django 3.1 only runs async function views, not async class based views
+@require_safe_async
+async def course_list(request, subject=None):
+    # here i'm gonna implement cache system
+    # every key is versioned by its namespaces (see courses/cache.py), the signals
+    # bump the namespaces when a subject, course or module changes
+    # the cached values are compact snapshots (tuples) not querysets, see courses/catalog.py
+    # the catalog keys are read on every request, aget_or_compute() keeps them in the
+    # memory of the process too, so most requests don't even go to memcached
+    # and when they expire only one worker rebuilds them (no stampede on the database)
+    # retrive all subject with total number of courses contain in each subject
+    if subject:
+        subjects = load_subjects(
+            await aget_or_compute('all_subjects', build_subjects_snapshot, CATALOG_TIMEOUT, 'subjects')
         )
-        if subject:
-            # if slug subject parameter is given then we retrive the coresponding subject
-            subject = get_object_or_404(Subject, slug=subject)
-            # cacheing based on dynamic data:
-            # many time you want to cache someting which is based on dynamic data in the case 
-            # you have to build dynamic keys to contain all information require uniquely 
-            # identify the cache data
-            # here is the key which i mentioned before
-            # if there is a subject i build  a key dynamically
-            key = 'subject_{}_courses'.format(subject.id)
-            courses = cache.get(key)
-            if not courses:
-                courses  = all_courses.filter(subject=subject)
-                cache.set(key, courses)
-        else:
-            courses = cache.get('all_courses')
-            if not courses:
-                courses = all_courses
-                cache.set('all_courses', courses)
-        return self.render_to_response(
-            {
-            'subjects': subjects,
-            'subject': subject,
-            'courses': courses
-            }
+        # if slug subject parameter is given then we retrive the coresponding subject
+        # from the subjects i already have, no query
+        subject = next((row for row in subjects if row.slug == subject), None)
+        if subject is None:
+            raise Http404('No Subject matches the given query.')
+        # cacheing based on dynamic data:
+        # many time you want to cache someting which is based on dynamic data in the case 
+        # you have to build dynamic keys to contain all information require uniquely 
+        # identify the cache data
+        # here is the key which i mentioned before
+        # if there is a subject i build  a key dynamically
+        courses = await aget_or_compute(
+            'subject_{}_courses'.format(subject.id),
+            lambda: build_courses_snapshot(subject.id),
+            CATALOG_TIMEOUT,
+            subject_namespace(subject.id)
         )
+    else:
+        # both keys are looked up at the same time
+        subjects, courses = await aget_or_compute_many(
+            ('all_subjects', build_subjects_snapshot, CATALOG_TIMEOUT, ('subjects', )),
+            ('all_courses', build_courses_snapshot, CATALOG_TIMEOUT, ('courses', )),
+        )
+        subjects = load_subjects(subjects)
+    response = await sync_to_async(render)(request, 'courses/course/list.html', {
+        'subjects': subjects,
+        'subject': subject,
+        'courses': load_courses(courses)
+    })
+    # the page itself is never cached by the site wide cache middleware, otherwise
+    # the versioned keys above would still be hidden behind a 15 minutes old page
+    # (the never_cache decorator of django 3.1 doesn't work on async views)
+    add_never_cache_headers(response)
+    return response
+
+
+def render_course_detail(request, slug):
+    # the template shows the subject and the instructor
+    course = get_object_or_404(Course.objects.select_related('subject', 'owner'), slug=slug)
+    return render(request, 'courses/course/detail.html', {
+        'object': course,
+        'course': course,
+        # i initialized the hidden form field with current course object, so it can be submitted directly
+        'enroll_form': CourseEnrollForm(initial={'course': course}),
+    })
 
 
-class CourseDetailView(DetailView):
-    model = Course
-    template_name = "courses/course/detail.html"
+@require_safe_async
+async def course_detail(request, slug):
+    return await sync_to_async(render_course_detail)(request, slug)
+    
 
-    def get_context_data(self, **kwargs):
-        context = super(CourseDetailView, self).get_context_data(**kwargs)
-        # i initialized the hidden form field with current course object, so it can be submitted directly
-        context["enroll_form"] = CourseEnrollForm(initial={'course': self.object})
-        return context
-    
\ No newline at end of file
+# a variant of an Image content which wasn't made yet (see courses/thumbnails.py), the srcset
+# links here until it exists. it's made now and the browser is sent to the file, the next
+# requests go straight to the file
+@require_safe
+def image_variant(request, id, width, fmt):
+    item = get_object_or_404(Image, id=id)
+    name = thumbnails.make_variant(item, width, fmt)
+    if name is None:
+        raise Http404('No such variant of this image.')
+    return redirect(default_storage.url(name))
+
+
+# full text search over the courses, modules and text contents (see courses/search.py)
+# the results change with every edit, so the page is never cached
+@method_decorator(never_cache, name='dispatch')
+class SearchView(TemplateResponseMixin, View):
+    template_name = 'courses/course/search.html'
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        return self.render_to_response({
+            'query': query,
+            'results': search(query, user=request.user) if query else [],
+        })
+
+
+# cache telemetry dashboard (see courses/telemetry.py), config/urls.py wraps it in
+# admin.site.admin_view so only the staff can see it
+class CacheTelemetryView(TemplateResponseMixin, View):
+    template_name = 'admin/cache_telemetry.html'
+
+    def get(self, request):
+        # each_context() gives the admin templates what they need (site header, user links...)
+        context = admin.site.each_context(request)
+        context.update({'title': 'Cache telemetry', 'namespaces': collect()})
+        return self.render_to_response(context)
@@ -0,0 +1,138 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+from courses.counters import adjust
+from courses.models import Course
+
+# enrollment index:
+# the ids of the courses every student is enrolled in, kept in the cache as a small
+# frozenset per user, so the access checks (student pages, IsEnrolled) don't need the database.
+# the sets are updated in place when students enroll (see students/signals.py), once the
+# enrollment is committed, and rebuilt from the database the next time they are needed when
+# they are missing. a removal drops the whole set: an update could be lost, a missing set can't
+# so a course in the set can be trusted, a course missing from it is checked in the database
+
+ENROLLMENT_KEY = 'enrollments_{}'
+ENROLLMENT_TIMEOUT = getattr(settings, 'ENROLLMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+ENROLL_BATCH_SIZE = getattr(settings, 'ENROLL_BATCH_SIZE', 500)
+
+
+def enrolled_course_ids(user):
+    """Return the set of course ids `user` is enrolled in (empty for anonymous users)."""
+    if not user.is_authenticated:
+        return frozenset()
+    key = ENROLLMENT_KEY.format(user.pk)
+    course_ids = cache.get(key)
+    if course_ids is None:
+        course_ids = frozenset(user.courses_joined.values_list('id', flat=True))
+        cache.set(key, course_ids, ENROLLMENT_TIMEOUT)
+    return course_ids
+
+
+def is_enrolled(user, course_id):
+    course_id = int(course_id)
+    if course_id in enrolled_course_ids(user):
+        return True
+    # the django cache api has no compare-and-set, two enrollments of the same user at the
+    # very same moment can overwrite each other, so a miss is checked before the 404/403
+    if user.is_authenticated and user.courses_joined.filter(id=course_id).exists():
+        forget_enrollments(user.pk)
+        return True
+    return False
+
+
+def add_enrollments(user_id, course_ids):
+    course_ids = frozenset(course_ids)
+    # a rolled back enrollment never grants access
+    transaction.on_commit(lambda: _add(user_id, course_ids))
+
+
+def _add(user_id, course_ids):
+    key = ENROLLMENT_KEY.format(user_id)
+    current = cache.get(key)
+    # a set which is not cached is simply built the next time it's needed
+    if current is not None:
+        cache.set(key, current | course_ids, ENROLLMENT_TIMEOUT)
+
+
+def forget_enrollments(*user_ids):
+    """Drop the sets of the users who left a course, they are rebuilt from the database."""
+    keys = [ENROLLMENT_KEY.format(user_id) for user_id in user_ids]
+    # right away, so the access is gone even if the transaction is still running, and again
+    # after the commit, a set rebuilt in the meantime still had the course
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _batches(ids, size=ENROLL_BATCH_SIZE):
+    ids = sorted(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _existing(model, ids):
+    found = set()
+    for batch in _batches(ids):
+        found.update(model.objects.filter(id__in=batch).values_list('id', flat=True))
+    return found
+
+
+def bulk_enroll(course_ids, user_ids, batch_size=ENROLL_BATCH_SIZE):
+    """Enroll every given user in every given course.
+
+    meant for many users --> one course or one user --> many courses. the rows which
+    already exist are skipped and the new ones are inserted in batches of the
+    Course.students through table (bulk_create with ignore_conflicts, so a concurrent
+    enrollment can't make it fail). the enrollment index is updated in the same pass.
+    """
+    course_ids = {int(id) for id in course_ids}
+    user_ids = {int(id) for id in user_ids}
+    known_courses = _existing(Course, course_ids)
+    known_users = _existing(User, user_ids)
+
+    Enrollment = Course.students.through
+    existing = set()
+    for courses in _batches(known_courses):
+        for users in _batches(known_users):
+            existing.update(Enrollment.objects.filter(course_id__in=courses, user_id__in=users)
+                            .values_list('course_id', 'user_id'))
+    rows = [
+        Enrollment(course_id=course_id, user_id=user_id)
+        for course_id in sorted(known_courses) for user_id in sorted(known_users)
+        if (course_id, user_id) not in existing
+    ]
+    with transaction.atomic():
+        Enrollment.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        # one F() update per distinct number of new students (usually just one),
+        # a row skipped by ignore_conflicts is counted too, reconcile_counters fixes that
+        new_students = Counter(row.course_id for row in rows)
+        by_total = {}
+        for course_id, total in new_students.items():
+            by_total.setdefault(total, []).append(course_id)
+        for total, ids in by_total.items():
+            adjust(Course, ids, 'student_count', total)
+
+    # bulk_create doesn't send m2m_changed, so the index is updated here
+    added = {}
+    for row in rows:
+        added.setdefault(row.user_id, set()).add(row.course_id)
+    transaction.on_commit(lambda: _add_many(added))
+    return {
+        'enrolled': len(rows),
+        'already_enrolled': len(existing),
+        'unknown_courses': sorted(course_ids - known_courses),
+        'unknown_users': sorted(user_ids - known_users),
+    }
+
+
+def _add_many(added):
+    # the same as add_enrollments() for many users, with one get_many and one set_many
+    keys = {ENROLLMENT_KEY.format(user_id): course_ids for user_id, course_ids in added.items()}
+    current = cache.get_many(keys.keys())
+    cache.set_many({
+        key: course_ids | frozenset(keys[key]) for key, course_ids in current.items()
+    }, ENROLLMENT_TIMEOUT)
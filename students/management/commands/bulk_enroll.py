@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from students.enrollment import bulk_enroll
+
+
+class Command(BaseCommand):
+    help = 'Enroll many users in one course, or one user in many courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, nargs='+', default=[], help='course ids')
+        parser.add_argument('--user', type=int, nargs='+', default=[], help='user ids')
+        parser.add_argument('--file', help='file with one more id per line (users with one --course, '
+                                           'courses with one --user)')
+
+    def handle(self, *args, **options):
+        courses, users = options['course'], options['user']
+        if options['file']:
+            with open(options['file']) as ids:
+                extra = [int(line) for line in ids if line.strip()]
+            if len(courses) == 1 and not users:
+                users = extra
+            elif len(users) == 1 and not courses:
+                courses = extra
+            else:
+                raise CommandError('--file needs exactly one --course or one --user')
+        if not courses or not users or (len(courses) > 1 and len(users) > 1):
+            raise CommandError('Give one course and many users, or one user and many courses')
+        result = bulk_enroll(courses, users)
+        self.stdout.write('{enrolled} new enrollments, {already_enrolled} already enrolled'.format(**result))
+        for name in ('unknown_courses', 'unknown_users'):
+            if result[name]:
+                self.stderr.write('{}: {}'.format(name.replace('_', ' '), result[name]))
@@ -0,0 +1,46 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from courses.counters import adjust
+from courses.models import Course
+from .enrollment import add_enrollments, forget_enrollments
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollments_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # course.students.add(user) --> instance is the course and pk_set the users
+    # user.courses_joined.add(course) --> (reverse) instance is the user and pk_set the courses
+    # for post_add pk_set only contains the rows which were really inserted, for post_remove
+    # it's every pk which was asked for, so the rows which really exist are read in pre_remove
+    # Course.student_count is changed in the same pass (see courses/counters.py)
+    if reverse:
+        if action == 'post_add':
+            add_enrollments(instance.pk, pk_set)
+            adjust(Course, pk_set, 'student_count', 1)
+        elif action == 'pre_remove':
+            instance._removed_course_ids = list(instance.courses_joined.filter(pk__in=pk_set)
+                                                .values_list('id', flat=True))
+        elif action == 'post_remove':
+            forget_enrollments(instance.pk)
+            adjust(Course, getattr(instance, '_removed_course_ids', []), 'student_count', -1)
+        elif action == 'pre_clear':
+            instance._cleared_course_ids = list(instance.courses_joined.values_list('id', flat=True))
+        elif action == 'post_clear':
+            forget_enrollments(instance.pk)
+            adjust(Course, getattr(instance, '_cleared_course_ids', []), 'student_count', -1)
+        return
+    if action == 'post_add':
+        for user_id in pk_set:
+            add_enrollments(user_id, [instance.pk])
+        adjust(Course, [instance.pk], 'student_count', len(pk_set))
+    elif action == 'pre_remove':
+        instance._removed_student_ids = list(instance.students.filter(pk__in=pk_set).values_list('id', flat=True))
+    elif action == 'post_remove':
+        forget_enrollments(*pk_set)
+        adjust(Course, [instance.pk], 'student_count', -len(getattr(instance, '_removed_student_ids', [])))
+    elif action == 'pre_clear':
+        # after the clear we don't know the students anymore
+        instance._cleared_student_ids = list(instance.students.values_list('id', flat=True))
+    elif action == 'post_clear':
+        forget_enrollments(*getattr(instance, '_cleared_student_ids', []))
+        adjust(Course, [instance.pk], 'student_count', -len(getattr(instance, '_cleared_student_ids', [])))
@@ -1,3 +1,132 @@
-from django.test import TestCase
+import io
+import json
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from courses import cache as catalog_cache
+from courses.models import Course, Module, Content, Text
+from courses.tests import create_course
+from .enrollment import ENROLLMENT_KEY, bulk_enroll, enrolled_course_ids, is_enrolled
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StudentTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, _, cls.course, cls.module = create_course()
+        cls.student = User.objects.create_user('student')
+        cls.other = User.objects.create_user('other')
+        Content.objects.create(module=cls.module, item=Text.objects.create(owner=cls.owner, title='t',
+                                                                           content='the group axioms'))
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local_cache.clear()
+        catalog_cache.local_generations.clear()
+
+
+class StudentCourseDetailTests(StudentTestCase):
+    def test_the_cached_page_is_only_served_to_the_students(self):
+        self.course.students.add(self.student)
+        url = '/students/course/{}/'.format(self.course.id)
+        self.client.force_login(self.student)
+        self.assertContains(self.client.get(url), 'the group axioms')
+        # the modules and contents are cached now, the check still runs first
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_module_of_another_course(self):
+        self.course.students.add(self.student)
+        other_course = Course.objects.create(owner=self.owner, subject=self.course.subject, title='Logic',
+                                             slug='logic', overview='overview')
+        module = Module.objects.create(course=other_course, title='Proofs', description='description')
+        self.client.force_login(self.student)
+        url = '/students/course/{}/{}/'.format(self.course.id, module.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = '/students/course/{}/{}/'.format(self.course.id, self.module.id)
+        self.assertContains(self.client.get(url), 'Groups')
+
+
+class BulkEnrollTests(StudentTestCase):
+    def post(self, data):
+        return self.client.post('/api/enrollments/', json.dumps(data), content_type='application/json')
+
+    def test_many_users_in_one_course(self):
+        self.course.students.add(self.student)
+        users = [User.objects.create_user('user-{}'.format(i)).id for i in range(5)]
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.post({'courses': [self.course.id], 'users': users + [self.student.id, 0]})
+        self.assertEqual(response.json(), {
+            'enrolled': 5, 'already_enrolled': 1, 'unknown_courses': [], 'unknown_users': [0],
+        })
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.students.count(), self.course.student_count), (6, 6))
+
+    def test_one_side_must_be_a_single_id(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.post({'courses': [1, 2], 'users': [1, 2]}).status_code, 400)
+        self.assertEqual(self.post({'courses': [1], 'users': ['x']}).status_code, 400)
+        self.client.force_login(self.student)
+        self.assertEqual(self.post({'courses': [self.course.id], 'users': [self.student.id]}).status_code, 403)
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command('bulk_enroll', course=[self.course.id], user=[self.student.id, self.other.id], stdout=stdout)
+        self.assertIn('2 new enrollments', stdout.getvalue())
+        self.assertEqual(set(self.course.students.all()), {self.student, self.other})
+
+
+# the index is updated on commit, TestCase never commits
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EnrollmentIndexTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        owner, subject, course, _ = create_course(with_module=False)
+        self.student = User.objects.create_user('student')
+        self.courses = [course, Course.objects.create(owner=owner, subject=subject, title='Logic', slug='logic',
+                                                      overview='overview')]
+
+    def cached(self):
+        return cache.get(ENROLLMENT_KEY.format(self.student.pk))
+
+    def test_updated_in_place_on_add(self):
+        self.assertEqual(enrolled_course_ids(self.student), frozenset())
+        self.courses[0].students.add(self.student)
+        self.student.courses_joined.add(self.courses[1])
+        self.assertEqual(self.cached(), {course.id for course in self.courses})
+
+    def test_dropped_on_remove(self):
+        self.courses[0].students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.courses[0].id))
+        self.courses[0].students.remove(self.student)
+        self.assertIsNone(self.cached())
+        self.assertFalse(is_enrolled(self.student, self.courses[0].id))
+
+    def test_a_rolled_back_enrollment_grants_nothing(self):
+        enrolled_course_ids(self.student)
+        try:
+            with transaction.atomic():
+                self.courses[0].students.add(self.student)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.cached(), frozenset())
+        self.assertFalse(is_enrolled(self.student, self.courses[0].id))
+
+    def test_a_lost_update_is_checked_in_the_database(self):
+        enrolled_course_ids(self.student)
+        Course.students.through.objects.create(course=self.courses[0], user=self.student)
+        self.assertTrue(is_enrolled(self.student, self.courses[0].id))
+        self.assertIsNone(self.cached())
+
+    def test_bulk_enroll(self):
+        enrolled_course_ids(self.student)
+        result = bulk_enroll([course.id for course in self.courses], [self.student.id, 0])
+        self.assertEqual((result['enrolled'], result['unknown_users']), (2, [0]))
+        self.assertEqual(self.cached(), {course.id for course in self.courses})
@@ -1,5 +1,4 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 
 from . import views
 
@@ -8,6 +7,6 @@ urlpatterns = [
     path('register/', views.StudentRegistrationForm.as_view(), name='student_registration'),
     path('enroll-course/', views.StudentEnrollCourseView.as_view(), name='student_enroll_course'),
     path('courses/', views.StudentCourseListView.as_view(), name="student_course_list"),
-    path('course/<int:pk>/', cache_page(60*15) (views.StudentCourseDetailView.as_view()), name="student_course_detail"),
-    path('course/<int:pk>/<int:module_id>/', cache_page(60*15) (views.StudentCourseDetailView.as_view()), name="student_course_detail_module"),
+    path('course/<int:pk>/', views.StudentCourseDetailView.as_view(), name="student_course_detail"),
+    path('course/<int:pk>/<int:module_id>/', views.StudentCourseDetailView.as_view(), name="student_course_detail_module"),
 ]
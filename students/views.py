@@ -1,13 +1,24 @@
 from django.shortcuts import render
+from django.http import Http404
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.generic.base import TemplateResponseMixin, View
+from django.conf import settings
 from django.urls import reverse_lazy
-from django.views.generic import ListView, DetailView
+from django.views.generic import ListView
 from django.views.generic.edit import CreateView, FormView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import authenticate, login
 from braces.views import LoginRequiredMixin
 
 from .forms import CourseEnrollForm
+from .enrollment import is_enrolled, enrolled_course_ids
 from courses.models import Course
+from courses.cache import get_or_build_tracked, record_dependencies, course_namespace, module_namespace
+
+STUDENT_PAGE_TIMEOUT = getattr(settings, 'STUDENT_PAGE_CACHE_TIMEOUT', 60 * 60 * 6)
+
 
 class StudentRegistrationForm(CreateView):
     template_name = "students/student/registration.html"
@@ -44,26 +55,54 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         qs = super(StudentCourseListView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        # the enrolled ids come from the cached enrollment index, no join needed
+        return qs.filter(id__in=enrolled_course_ids(self.request.user))
 
 
 
-class StudentCourseDetailView(DetailView):
-    model = Course
+# the page is put together from cached parts, so the response itself must not be
+# stored by the site wide cache middleware (it contains the header of the current user)
+@method_decorator(never_cache, name='dispatch')
+class StudentCourseDetailView(LoginRequiredMixin, TemplateResponseMixin, View):
     template_name = "students/course/detail.html"
 
-    def get_queryset(self):
-        qs = super(StudentCourseDetailView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
-    
-    def get_context_data(self, **kwargs):
-        context = super(StudentCourseDetailView, self).get_context_data(**kwargs)
-        # get course object
-        course = self.get_object()
-        if 'module_id' in self.kwargs:
+    def get(self, request, pk, module_id=None):
+        # the access check runs before anything cached is returned
+        if not is_enrolled(request.user, pk):
+            raise Http404
+        # the modules and contents are the same for every student, so they are cached
+        # once per course/module and the page around them is rendered for every user
+        key = 'student_course_page:{}:{}'.format(pk, module_id or 'first')
+        page = get_or_build_tracked(
+            key, lambda: self.build_page(pk, module_id), STUDENT_PAGE_TIMEOUT,
+            course_namespace(pk)
+        )
+        if page is None:
+            raise Http404
+        return self.render_to_response(page)
+
+    def build_page(self, course_id, module_id=None):
+        course = Course.objects.filter(id=course_id).first()
+        if course is None:
+            return None
+        modules = list(course.modules.all())
+        if module_id:
             # get current module
-            context['module'] = course.modules.get(id=self.kwargs['module_id'])
+            module = next((m for m in modules if m.id == int(module_id)), None)
+            if module is None:
+                return None
         else:
-            # get first module 
-            context['module']=Course.objects.all()[0]
-        return context
+            # get first module
+            module = modules[0] if modules else None
+        if module is not None:
+            record_dependencies(module_namespace(module.id))
+        body = render_to_string("students/course/module.html", {
+            'object': course,
+            'modules': modules,
+            'module': module,
+        })
+        return {
+            'title': course.title,
+            'module_title': module.title if module else '',
+            'body': body,
+        }